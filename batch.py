@@ -0,0 +1,227 @@
+# Installs the payload into many prefixes at once (chroots, containers, user homes), run through main.py:
+#   python3 main.py --batch-prefix /srv/chroot1/usr --batch-prefix /srv/chroot2/usr
+#   python3 main.py --batch-file prefixes.txt --batch-workers 16
+# Every payload file is read (and decompressed and hashed) once, each chunk is then written to all of the targets
+# by a pool of writer threads while the next chunk is being read
+# Each file is written to a staged copy next to its destination, once every file of a prefix is staged and verified
+# they are renamed into place together under that prefix's install journal, see install_journal.py
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from colors import Colors
+from compression import compression_of, open_decompressed
+from copy_engine import (advise, clamp_buffer_size, drop_cached, new_hash, preallocate, sync_file,
+                         CopyProgress, DEFAULT_DURABILITY, FADV_SEQUENTIAL)
+from headless import ProgressBar
+from install_journal import staged_path, InstallJournal
+from log import log_out, open_log, close_log, set_terminal_output, ERROR
+from program import payload_entries, PROGRAM_NAME, VERSION, LOG_PATH, COPY_BUFFER_SIZE, DURABILITY
+from install_engine import RECEIPT_ALGORITHM
+from receipts import write_receipt
+
+fg, bg = Colors.Foreground, Colors.Background
+
+BATCH_WORKERS = 8
+
+
+class BatchTarget:  # One prefix being installed into, with what happened to it for the summary
+    def __init__(self, prefix, entries, durability=DEFAULT_DURABILITY):
+        self.prefix = prefix
+        self.entries = entries
+        self.journal = InstallJournal(prefix, [entry.destination for entry in entries], durability)
+        self.error = None
+        self.bytes_written = 0
+        self.files_installed = 0
+        self.finished = None  # time.monotonic() when the last file finished or the target failed
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+            self.finished = time.monotonic()
+            log_out(fg.red + f"[batch]: \"{self.prefix}\" failed: {error}" + Colors.reset, level=ERROR)
+
+
+def read_prefixes(arguments):
+    prefixes = list(arguments.batch_prefix or [])
+    if arguments.batch_file:
+        with open(arguments.batch_file) as f:
+            prefixes += [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    return [os.path.abspath(os.path.expanduser(prefix)) for prefix in prefixes]
+
+
+def write_chunk(target, output_file, chunk):
+    output_file.write(chunk)
+    target.bytes_written += len(chunk)
+    drop_cached(output_file, output_file.tell())
+
+
+def finish_file(output_file, path, durability):  # The directory is synced once the file was renamed into it
+    sync_file(output_file, path, "fsync" if durability == "fsync+dir" else durability)
+    drop_cached(output_file, output_file.tell())
+
+
+def fan_out_file(index, targets, pool, progress, cancel_event, buffer_size=COPY_BUFFER_SIZE,
+                 durability=DEFAULT_DURABILITY):
+    # Copy entry number index of every target's manifest, all targets share the same source file
+    entry = targets[0].entries[index]
+    compression = compression_of(entry.source)
+    outputs = {}
+    for target in targets:
+        if target.error is not None:
+            continue
+        destination = target.entries[index].destination
+        try:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            outputs[target] = open(staged_path(destination), "wb")
+            if not compression:  # The decompressed size is not known up front
+                preallocate(outputs[target], entry.size)
+        except OSError as e:
+            target.fail(e)
+    staged_targets = list(outputs)
+
+    algorithm = entry.algorithm or RECEIPT_ALGORITHM  # Every chunk is read in Python anyway, the receipts record it
+    hasher = new_hash(algorithm)
+    copied_before = progress.copied_bytes
+    try:
+        with open(entry.source, "rb") as raw_file:
+            advise(raw_file, FADV_SEQUENTIAL)
+            input_file = open_decompressed(raw_file, compression) if compression else raw_file
+            chunk = input_file.read(buffer_size)
+            while chunk and outputs and not cancel_event.is_set():
+                hasher.update(chunk)
+                writes = {pool.submit(write_chunk, target, output_file, chunk): target
+                          for target, output_file in outputs.items()}
+                next_chunk = input_file.read(buffer_size)  # Read ahead while the targets are being written
+                for future, target in writes.items():
+                    try:
+                        future.result()
+                    except OSError as e:
+                        target.fail(e)
+                        outputs.pop(target).close()
+                progress.advance(copied_before + raw_file.tell() - progress.copied_bytes)
+                drop_cached(raw_file, raw_file.tell())
+                chunk = next_chunk
+            if compression:
+                input_file.close()
+        if not cancel_event.is_set():  # Every target syncs in parallel on the pool
+            syncs = {pool.submit(finish_file, output_file, staged_path(target.entries[index].destination),
+                                 durability): target for target, output_file in outputs.items()}
+            for future, target in syncs.items():
+                try:
+                    future.result()
+                except OSError as e:
+                    target.fail(e)
+                    outputs.pop(target).close()
+    finally:
+        for output_file in outputs.values():
+            output_file.close()
+
+    verified = entry.digest is None or hasher.hexdigest() == entry.digest.lower()
+    for target in staged_targets:  # Failed or canceled targets leave their staged files to the journal's rollback
+        if not cancel_event.is_set() and target.error is None:
+            if not verified:
+                target.fail(IOError(f"\"{entry.source}\" does not match its {hasher.name} digest"))
+            else:
+                try:
+                    os.chmod(staged_path(target.entries[index].destination), target.entries[index].mode)
+                    target.entries[index].installed_digest = (algorithm, hasher.hexdigest())
+                    target.files_installed += 1
+                except OSError as e:
+                    target.fail(e)
+
+
+def install_batch(prefixes, max_workers=BATCH_WORKERS, progress_callback=None, cancel_event=None,
+                  buffer_size=COPY_BUFFER_SIZE, durability=DURABILITY):
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    buffer_size = clamp_buffer_size(buffer_size)
+    targets = [BatchTarget(prefix, payload_entries(prefix), durability) for prefix in prefixes]
+    for target in targets:
+        try:
+            target.journal.begin()  # Finishes or rolls back an interrupted install into the same prefix
+        except OSError as e:
+            target.fail(e)
+    progress = CopyProgress(sum(entry.size for entry in targets[0].entries), progress_callback)
+    log_out(f"[install_batch]: installing {len(targets[0].entries)} files into {len(targets)} prefixes "
+            f"with {max_workers} writers")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for index in range(len(targets[0].entries)):
+            if cancel_event.is_set():
+                break
+            fan_out_file(index, targets, pool, progress, cancel_event, buffer_size, durability)
+
+    for target in targets:  # Each prefix gets all of the new files or keeps all of its old ones
+        if target.error is None and not cancel_event.is_set():
+            try:
+                target.journal.commit()
+            except OSError as e:  # commit() already rolled the prefix back
+                target.fail(e)
+            else:
+                write_receipt(target.prefix, target.entries)
+        else:
+            try:
+                target.journal.rollback()
+            except OSError as e:
+                log_out(fg.red + f"[install_batch]: could not roll back \"{target.prefix}\": {e}" + Colors.reset,
+                        level=ERROR)
+        if target.finished is None:
+            target.finished = time.monotonic()
+    if not cancel_event.is_set():
+        progress.finish()
+    return targets
+
+
+def print_summary(targets, started):
+    elapsed = time.monotonic() - started
+    print(f"\n{'prefix':<40} {'status':<8} {'files':>6} {'MB':>10} {'seconds':>8}")
+    for target in targets:
+        status, color = ("ok", fg.green) if target.error is None else ("failed", fg.red)
+        print(f"{target.prefix:<40} {color}{status:<8}{Colors.reset} {target.files_installed:>6} "
+              f"{target.bytes_written / 1e6:>10.1f} {target.finished - started:>8.2f}")
+        if target.error is not None:
+            print(f"    {target.error}")
+    written = sum(target.bytes_written for target in targets)
+    failed = sum(target.error is not None for target in targets)
+    print(f"\n{len(targets) - failed} of {len(targets)} prefixes installed, {written / 1e6:.1f} MB written in "
+          f"{elapsed:.2f} seconds ({written / 1e6 / elapsed if elapsed else 0:.1f} MB/s)")
+    return failed
+
+
+def run_batch(arguments):
+    open_log(LOG_PATH)
+    set_terminal_output(False)
+    prefixes = read_prefixes(arguments)
+    if not prefixes:
+        print(fg.red + "No prefixes given, use --batch-prefix or --batch-file" + Colors.reset)
+        return 1
+    print(f"Installing {PROGRAM_NAME} {VERSION} into {len(prefixes)} prefixes, logging to {LOG_PATH}")
+
+    cancel_event = threading.Event()
+
+    def cancel(signum, frame):  # Stops the copy between chunks so the staged files are still removed
+        print("\nCanceling...")
+        cancel_event.set()
+
+    max_workers = BATCH_WORKERS if arguments.batch_workers is None else arguments.batch_workers
+    started = time.monotonic()
+    previous_handler = signal.signal(signal.SIGINT, cancel)
+    try:
+        targets = install_batch(prefixes, max_workers, ProgressBar().draw, cancel_event,
+                                durability=arguments.durability)
+    except (IOError, ValueError, KeyError) as e:
+        print(fg.red + f"\nInstallation failed: {e}" + Colors.reset)
+        close_log()
+        return 1
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    if cancel_event.is_set():
+        print("Installation canceled")
+        close_log()
+        return 130
+    failed = print_summary(targets, started)
+    close_log()
+    return 1 if failed else 0
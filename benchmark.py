@@ -0,0 +1,293 @@
+#! /bin/python3
+# Install-time benchmark suite, runs headless against synthetic payloads in tmpfs and on-disk temp directories
+#   python3 benchmark.py --json results.json
+#   python3 benchmark.py --suites copy --sizes 1K,1M,100M,1G,10G --buffer-sizes 1M,4M,8M --dirs /var/tmp
+# Suites: copy (throughput, CPU and peak RSS per file and buffer size), hash, logging (cost per log_out call),
+# placeholders (substitution cost), shortcuts (.desktop generation) and install (end to end latency)
+# The JSON output records the git commit so results from different commits can be compared
+# Every copy case runs in its own process so the peak RSS reported belongs to that case only
+# Use --methods buffered to measure the plain read/write loop without the kernel side copy paths
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from copy_engine import COPY_METHODS
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+DEFAULT_SIZES = "1K,64K,1M,16M,256M,1G,10G"
+DEFAULT_BUFFER_SIZES = "1M,4M,8M"
+SUITES = ("copy", "hash", "logging", "placeholders", "shortcuts", "install")
+HASH_SIZE = 64 * 1024 * 1024
+LOG_RECORDS = 100000
+INSTALL_RUNS = 20
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def default_dirs():  # A tmpfs directory to measure the CPU side and an on-disk one to measure real I/O
+    dirs = []
+    if os.path.isdir("/dev/shm"):
+        dirs.append("/dev/shm")
+    dirs.append("/var/tmp" if os.path.isdir("/var/tmp") else tempfile.gettempdir())
+    return ",".join(dirs)
+
+
+def free_space(directory):
+    stats = os.statvfs(directory)
+    return stats.f_bavail * stats.f_frsize
+
+
+def remove_if_exists(path):  # Payloads are removed even when writing them failed part way
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_payload(path, size):  # Fill the source file with random data so the filesystem cannot cheat with sparse files
+    block = os.urandom(min(size, 1024 * 1024)) if size else b""
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def run_case(src, dst, buffer_size, methods):  # Runs inside the child process
+    from copy_engine import copy_file
+
+    start = time.perf_counter()
+    copy_file(src, dst, buffer_size=buffer_size, methods=methods)
+    elapsed = time.perf_counter() - start
+    os.remove(dst)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {"seconds": elapsed, "cpu_seconds": usage.ru_utime + usage.ru_stime, "peak_rss_bytes": peak_rss()}
+
+
+def peak_rss():
+    # ru_maxrss survives exec, so a child started by a parent that once used a lot of memory would report the
+    # parent's peak, VmHWM belongs to the child's own address space
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # In KiB on Linux
+
+
+def bench_copy(directory, args):
+    results = []
+    print(f"{'size':>12} {'buffer':>10} {'MB/s':>10} {'CPU (s)':>10} {'peak RSS (MiB)':>15}")
+    for size in map(parse_size, args.sizes.split(",")):
+        src = os.path.join(directory, f"copy-benchmark-{size}.src")
+        dst = os.path.join(directory, f"copy-benchmark-{size}.dst")
+        if 2 * size > free_space(directory):  # The source and its copy, tmpfs would otherwise fill up memory
+            print(f"{size:>12} skipped, \"{directory}\" has {free_space(directory) / 1024 ** 2:.0f} MiB free")
+            continue
+        try:
+            make_payload(src, size)
+            for buffer_size in map(parse_size, args.buffer_sizes.split(",")):
+                command = [sys.executable, os.path.realpath(__file__), "--case", src, dst, str(buffer_size),
+                           args.methods]
+                output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+                case = json.loads(output.splitlines()[-1])
+                case.update({"size": size, "buffer_size": buffer_size,
+                             "mb_per_second": size / 1e6 / case["seconds"] if case["seconds"] else 0.0})
+                results.append(case)
+                print(f"{size:>12} {buffer_size:>10} {case['mb_per_second']:>10.1f} {case['cpu_seconds']:>10.3f} "
+                      f"{case['peak_rss_bytes'] / 1024 ** 2:>15.1f}")
+        finally:
+            remove_if_exists(src)
+            remove_if_exists(dst)
+    return results
+
+
+def bench_hash(directory, args):  # Hashing cost on its own, and a hashed copy compared with a plain buffered one
+    from copy_engine import copy_file, new_hash, HASH_ALGORITHMS, xxhash
+
+    data = os.urandom(HASH_SIZE)
+    src = os.path.join(directory, "hash-benchmark.src")
+    dst = os.path.join(directory, "hash-benchmark.dst")
+    results = []
+    print(f"{'algorithm':>12} {'hash MB/s':>10} {'copy MB/s':>10}")
+    try:
+        make_payload(src, HASH_SIZE)
+        for algorithm in (None,) + HASH_ALGORITHMS:
+            if algorithm == "xxh64" and xxhash is None:
+                continue
+            hash_seconds = None
+            if algorithm is not None:
+                hasher = new_hash(algorithm)
+                start = time.perf_counter()
+                hasher.update(data)
+                hash_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            copy_file(src, dst, methods=("buffered",), hasher=new_hash(algorithm) if algorithm else None)
+            copy_seconds = time.perf_counter() - start
+            os.remove(dst)
+            result = {"algorithm": algorithm or "none", "size": HASH_SIZE,
+                      "hash_mb_per_second": HASH_SIZE / 1e6 / hash_seconds if hash_seconds else None,
+                      "copy_mb_per_second": HASH_SIZE / 1e6 / copy_seconds}
+            results.append(result)
+            hash_speed = f"{result['hash_mb_per_second']:.1f}" if hash_seconds else "-"
+            print(f"{result['algorithm']:>12} {hash_speed:>10} {result['copy_mb_per_second']:>10.1f}")
+    finally:
+        remove_if_exists(src)
+        remove_if_exists(dst)
+    return results
+
+
+def bench_logging(directory, args):  # Cost of one log_out call as seen by the copy loop, with and without rate limiting
+    import log
+
+    log_path = os.path.join(directory, "logging-benchmark.log")
+    log_level = log.LOG_LEVEL
+    log.LOG_LEVEL = log.INFO
+    log.open_log(log_path)
+    log.set_terminal_output(False)
+    results = []
+    try:
+        for rate_limit in (None, "benchmark"):
+            start = time.perf_counter()
+            for index in range(LOG_RECORDS):
+                log.log_out(f"[copy_file]: INFO: {index % 100}% Complete ", rate_limit=rate_limit)
+            call_seconds = time.perf_counter() - start
+            log.flush_log()
+            total_seconds = time.perf_counter() - start
+            result = {"rate_limited": rate_limit is not None, "records": LOG_RECORDS,
+                      "call_ns": call_seconds / LOG_RECORDS * 1e9, "written_ns": total_seconds / LOG_RECORDS * 1e9}
+            results.append(result)
+            print(f"rate limited: {str(result['rate_limited']):<5} {result['call_ns']:>8.0f} ns per call, "
+                  f"{result['written_ns']:>8.0f} ns per record including the write")
+    finally:
+        log.close_log()
+        log.set_terminal_output(True)
+        log.LOG_LEVEL = log_level
+        os.remove(log_path)
+    return results
+
+
+def bench_placeholders(directory, args):
+    from placeholders import substitute
+
+    substitutions = {f"key{index}": f"value {index}" for index in range(20)}
+    results = []
+    for length in (1000, 100000):  # A label and a long license text
+        text = " ".join(f"{{key{index % 40}}}" if index % 10 == 0 else "lorem" for index in range(length // 6))
+        runs = max(10, 1000000 // length)
+        start = time.perf_counter()
+        for _ in range(runs):
+            substitute(text, substitutions)
+        seconds = (time.perf_counter() - start) / runs
+        results.append({"text_length": len(text), "keys": len(substitutions), "microseconds": seconds * 1e6})
+        print(f"{len(text):>8} characters, {len(substitutions)} keys: {seconds * 1e6:>10.1f} us")
+    return results
+
+
+def bench_shortcuts(directory, args):
+    from program import write_shortcut
+
+    path = os.path.join(directory, "benchmark.desktop")
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        write_shortcut(path)
+    seconds = (time.perf_counter() - start) / runs
+    os.remove(path)
+    print(f"{seconds * 1e6:>10.1f} us per shortcut")
+    return [{"microseconds": seconds * 1e6}]
+
+
+def bench_install(directory, args):  # End to end: copy, verify and chmod into a fresh prefix
+    from copy_engine import new_hash
+    from install_engine import install_manifest, install_variables, ManifestEntry
+
+    results = []
+    for size in (1024 * 1024, 64 * 1024 * 1024):
+        src = os.path.join(directory, "install-benchmark.src")
+        timings = []
+        try:
+            make_payload(src, size)
+            hasher = new_hash("sha256")
+            with open(src, "rb") as f:
+                hasher.update(f.read())
+            for _ in range(INSTALL_RUNS):
+                prefix = tempfile.mkdtemp(dir=directory)
+                entry = ManifestEntry(src, os.path.join(install_variables(prefix)["bin"], "benchmark"), 0o744,
+                                      "sha256", hasher.hexdigest())
+                start = time.perf_counter()
+                install_manifest([entry], prefix)
+                timings.append(time.perf_counter() - start)
+                shutil.rmtree(prefix)
+        finally:
+            remove_if_exists(src)
+        timings.sort()
+        result = {"size": size, "runs": INSTALL_RUNS, "median_ms": timings[len(timings) // 2] * 1000,
+                  "min_ms": timings[0] * 1000, "max_ms": timings[-1] * 1000}
+        results.append(result)
+        print(f"{size:>12} bytes: median {result['median_ms']:.1f} ms, min {result['min_ms']:.1f} ms, "
+              f"max {result['max_ms']:.1f} ms")
+    return results
+
+
+SUITE_FUNCTIONS = {"copy": bench_copy, "hash": bench_hash, "logging": bench_logging,
+                   "placeholders": bench_placeholders, "shortcuts": bench_shortcuts, "install": bench_install}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the installer's copy, hash, logging, placeholder, "
+                                                 "shortcut and install paths")
+    parser.add_argument("--suites", default=",".join(SUITES), help="comma separated suites to run")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated copy sizes, e.g. 1K,1M,1G")
+    parser.add_argument("--buffer-sizes", default=DEFAULT_BUFFER_SIZES, help="comma separated buffer sizes")
+    parser.add_argument("--dirs", default=default_dirs(), help="comma separated directories to benchmark in")
+    parser.add_argument("--json", help="also write the results to this file as JSON")
+    parser.add_argument("--methods", default=",".join(COPY_METHODS), help="comma separated copy methods to allow")
+    parser.add_argument("--case", nargs=4, metavar=("SRC", "DST", "BUFFER_SIZE", "METHODS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        src, dst, buffer_size, methods = args.case
+        sys.stdout = open(os.devnull, "w")  # Keep the copy log out of the measurement and the result line
+        print(json.dumps(run_case(src, dst, int(buffer_size), methods.split(","))), file=sys.__stdout__)
+        return 0
+
+    import log
+    log.LOG_LEVEL = log.ERROR  # The engine's own log lines would only add noise to the results
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "timestamp": datetime.datetime.now().isoformat(), "results": {}}
+    for directory in args.dirs.split(","):
+        for suite in args.suites.split(","):
+            print(f"\n== {suite} in {directory} ==")
+            report["results"].setdefault(directory, {})[suite] = SUITE_FUNCTIONS[suite](directory, args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,144 @@
+#! /bin/python3
+# Compressed payloads, "binary.zst", "binary.xz" or "binary.gz" are decompressed as a stream straight into the
+# destination, progress is measured against the compressed bytes read. Compress a payload as a build step with:
+#   python3 compression.py binary [--format zst|xz|gz]
+# zstd needs the optional "zstandard" module, xz and gzip only need the standard library
+import argparse
+import gzip
+import lzma
+import os
+import shutil
+import threading
+import zlib
+
+from colors import Colors
+from copy_engine import (advise, clamp_buffer_size, drop_cached, sync_file, CopyProgress, IntegrityError,
+                         DEFAULT_BUFFER_SIZE, DEFAULT_DURABILITY, FADV_SEQUENTIAL)
+from log import log_out, ERROR
+
+try:
+    import zstandard
+except ModuleNotFoundError:  # Optional, only needed for .zst payloads
+    zstandard = None
+
+fg, bg = Colors.Foreground, Colors.Background
+
+# Errors raised by the decompressors for truncated or corrupt archives, gzip raises zlib.error for corrupt data
+DECOMPRESSION_ERRORS = ((EOFError, lzma.LZMAError, zlib.error) +
+                        ((zstandard.ZstdError,) if zstandard is not None else ()))
+
+COMPRESSED_SUFFIXES = (".zst", ".xz", ".gz")  # In order of preference when more than one is shipped
+
+
+def compression_of(path):  # Returns the compression suffix of path, or None for an uncompressed file
+    suffix = os.path.splitext(path)[1]
+    return suffix if suffix in COMPRESSED_SUFFIXES else None
+
+
+def uncompressed_path(path):  # "binary.zst" -> "binary", digests are always of the uncompressed payload
+    return os.path.splitext(path)[0] if compression_of(path) else path
+
+
+def find_payload(path):  # The uncompressed payload if it exists, otherwise the first compressed one we can read
+    if os.path.exists(path):
+        return path
+    for suffix in COMPRESSED_SUFFIXES:
+        if suffix == ".zst" and zstandard is None:
+            continue
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return path
+
+
+def open_decompressed(raw_file, suffix):
+    if suffix == ".zst":
+        if zstandard is None:
+            raise ValueError("the payload is zstd compressed but the \"zstandard\" module is not installed")
+        # libzstd decodes a frame on a single thread, larger installs get their parallelism from the manifest pool
+        return zstandard.ZstdDecompressor().stream_reader(raw_file, read_across_frames=True, closefd=False)
+    if suffix == ".xz":
+        return lzma.LZMAFile(raw_file)
+    return gzip.GzipFile(fileobj=raw_file)
+
+
+def decompress_file(src, dst, buffer_size=DEFAULT_BUFFER_SIZE, progress_callback=None, cancel_event=None,
+                    hasher=None, expected_digest=None, durability=DEFAULT_DURABILITY):
+    # The decompressed size is not known up front, so unlike copy_file the destination is not preallocated
+    log_out(f"[decompress_file]: decompressing \"{src}\" to \"{dst}\"")
+    size = os.stat(src).st_size
+    buffer_size = clamp_buffer_size(buffer_size)
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    progress = CopyProgress(size, progress_callback)
+
+    try:
+        with open(src, "rb") as raw_file, open_decompressed(raw_file, compression_of(src)) as input_file:
+            advise(raw_file, FADV_SEQUENTIAL)
+            with open(dst, "wb") as output_file:
+                while not cancel_event.is_set():
+                    chunk = input_file.read(buffer_size)
+                    if not chunk:
+                        break
+                    output_file.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    progress.advance(raw_file.tell() - progress.copied_bytes)  # Compressed bytes consumed so far
+                    drop_cached(raw_file, raw_file.tell())
+                    drop_cached(output_file, output_file.tell())
+                if not cancel_event.is_set():
+                    sync_file(output_file, dst, durability)
+                    drop_cached(output_file, output_file.tell())
+        if cancel_event.is_set():
+            log_out(f"[decompress_file]: Canceled, removing \"{dst}\"")
+            os.remove(dst)
+            return False
+        if hasher is not None and expected_digest is not None:
+            if hasher.hexdigest() != expected_digest.lower():
+                os.remove(dst)
+                raise IntegrityError(f"\"{src}\" does not decompress to its {hasher.name} digest, "
+                                     f"expected {expected_digest} but got {hasher.hexdigest()}")
+            log_out(f"[decompress_file]: verified {hasher.name} digest {expected_digest}")
+        progress.finish()
+        return True
+
+    except (IOError,) + DECOMPRESSION_ERRORS as e:
+        log_out(fg.red + f"\n[decompress_file]: {e}" + Colors.reset, level=ERROR)
+        if not isinstance(e, IOError):  # Truncated or corrupt archives are reported like any other copy failure
+            raise IOError(f"\"{src}\" is not a valid {compression_of(src)} archive: {e}") from e
+        raise
+
+
+def compress_file(src, compression=".zst"):
+    if compression == ".zst" and zstandard is None:
+        raise ValueError("zstd compression needs the \"zstandard\" module")
+    dst = src + compression
+    with open(src, "rb") as input_file:
+        if compression == ".zst":
+            # Compression, unlike decompression, can use every core
+            compressor = zstandard.ZstdCompressor(level=19, threads=-1)
+            with open(dst, "wb") as output_file:
+                compressor.copy_stream(input_file, output_file)
+        elif compression == ".xz":
+            with lzma.open(dst, "wb", preset=9 | lzma.PRESET_EXTREME) as output_file:
+                shutil.copyfileobj(input_file, output_file, DEFAULT_BUFFER_SIZE)
+        else:
+            with gzip.open(dst, "wb", compresslevel=9) as output_file:
+                shutil.copyfileobj(input_file, output_file, DEFAULT_BUFFER_SIZE)
+    log_out(f"[compress_file]: compressed \"{src}\" ({os.stat(src).st_size} bytes) to \"{dst}\" "
+            f"({os.stat(dst).st_size} bytes)")
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress installer payloads")
+    parser.add_argument("payloads", nargs="+")
+    parser.add_argument("--format", choices=[suffix[1:] for suffix in COMPRESSED_SUFFIXES],
+                        default="zst" if zstandard is not None else "xz")
+    arguments = parser.parse_args()
+    for payload in arguments.payloads:
+        compress_file(payload, "." + arguments.format)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,375 @@
+import errno
+import hashlib
+import json
+import os
+import threading
+
+from colors import Colors
+from log import log_out, ERROR
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # Not on a POSIX system, reflinks are not available
+    fcntl = None
+try:
+    import xxhash
+except ModuleNotFoundError:  # Optional, only needed for payloads shipped with an .xxh64 digest
+    xxhash = None
+
+fg, bg = Colors.Foreground, Colors.Background
+
+# Buffer sizes used by copy_file, the buffer is allocated once and reused so memory use does not grow with the file
+MIN_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+MAX_BUFFER_SIZE = 8 * 1024 * 1024  # 8 MiB
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024  # 4 MiB
+
+# Copy methods in the order copy_file tries them, the kernel side methods never pass the data through Python
+COPY_METHODS = ("reflink", "copy_file_range", "sendfile", "buffered")
+FICLONE = 0x40049409  # ioctl from linux/fs.h, shares the source extents with the destination on btrfs/XFS
+# Errors that mean "this method is not supported here", anything else is a real copy failure
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                   errno.ENOTTY, errno.EPERM}
+
+# How sure copy_file is that the copy survives a power loss once it returns: "none" leaves it to the kernel's
+# writeback, "fsync" syncs the file, "fsync+dir" also syncs its directory so a newly created entry is durable too
+DURABILITY_MODES = ("none", "fsync", "fsync+dir")
+DEFAULT_DURABILITY = "none"
+
+# A resumable copy saves its offset and a hash of everything copied so far this often, see Checkpointer
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024  # 64 MiB
+
+# posix_fadvise hints, None where the platform does not have them
+FADV_SEQUENTIAL = getattr(os, "POSIX_FADV_SEQUENTIAL", None)
+FADV_DONTNEED = getattr(os, "POSIX_FADV_DONTNEED", None)
+
+# Digest files shipped next to a payload, e.g. "binary.sha256" in sha256sum format, checked in this order
+HASH_ALGORITHMS = ("blake2b", "sha256", "xxh64")
+
+
+class IntegrityError(IOError):  # The copied bytes do not match the digest shipped with the payload
+    pass
+
+
+def clamp_buffer_size(buffer_size):
+    return max(MIN_BUFFER_SIZE, min(MAX_BUFFER_SIZE, int(buffer_size)))
+
+
+def new_hash(algorithm):
+    if algorithm == "xxh64":
+        if xxhash is None:
+            raise ValueError("the xxh64 digest needs the \"xxhash\" module")
+        return xxhash.xxh64()
+    return hashlib.new(algorithm)
+
+
+def file_digest(path, algorithm, buffer_size=DEFAULT_BUFFER_SIZE):  # Streams the file, it is never read in whole
+    hasher = new_hash(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(buffer_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def read_payload_digest(payload_path):  # Returns (algorithm, hex digest) or (None, None) if none was shipped
+    for algorithm in HASH_ALGORITHMS:
+        if algorithm == "xxh64" and xxhash is None:
+            continue
+        try:
+            with open(f"{payload_path}.{algorithm}") as f:
+                return algorithm, f.read().split()[0].lower()
+        except (OSError, IndexError):
+            continue
+    return None, None
+
+
+def advise(file, advice, offset=0, length=0):  # A length of 0 means up to the end of the file
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(file.fileno(), offset, length, advice)
+    except OSError:  # Only a hint, a filesystem that does not take it still copies correctly
+        pass
+
+
+def drop_cached(file, end):
+    # Drops the first end bytes of file from the page cache so a large install does not evict the pages of running
+    # services. Clean pages go at once, dirty ones are only queued for writeback and dropped by a later call.
+    if end:
+        advise(file, FADV_DONTNEED, 0, end)
+
+
+def preallocate(output_file, size):  # Reserves all of the destination's blocks up front so it is not fragmented
+    if not size or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(output_file.fileno(), 0, size)
+    except OSError as e:
+        if e.errno not in FALLBACK_ERRNOS:  # A full disk fails here, before anything was copied
+            raise
+        log_out(f"[preallocate]: not supported here ({e.strerror}), the file grows as it is written")
+
+
+def sync_directory(path):
+    directory = os.open(path or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def sync_file(output_file, path, durability):
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"unknown durability mode \"{durability}\", expected one of {DURABILITY_MODES}")
+    if durability == "none":
+        return
+    output_file.flush()
+    os.fsync(output_file.fileno())
+    if durability == "fsync+dir":
+        sync_directory(os.path.dirname(path))
+
+
+def checkpoint_path(path):
+    return f"{path}.checkpoint"
+
+
+class Checkpointer:
+    # Stands in for the payload hasher in copy_buffered, hashing the copied prefix as well and saving it with its
+    # offset to a sidecar file next to dst. An interrupted copy is resumed from the last checkpoint once the prefix
+    # already in dst hashes the same, re-reading the local dst is much cheaper than copying the payload again.
+    def __init__(self, src, dst, hasher=None):
+        stat = os.stat(src)
+        self.path = checkpoint_path(dst)
+        self.dst = dst
+        self.source = {"source": os.path.realpath(src), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self.hasher = hasher
+        self.prefix_hasher = hashlib.blake2b()
+        self.offset = 0
+        self.saved_offset = 0
+
+    def update(self, data):
+        self.prefix_hasher.update(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.offset += len(data)
+        if self.offset - self.saved_offset >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(dict(self.source, offset=self.offset, digest=self.prefix_hasher.hexdigest()), f)
+        os.replace(self.path + ".tmp", self.path)
+        self.saved_offset = self.offset
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def resume(self, buffer_size):  # Returns the offset to continue from, 0 if there is nothing usable to resume
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            offset = saved["offset"]
+            if {key: saved.get(key) for key in self.source} != self.source:
+                log_out(f"[Checkpointer]: \"{self.source['source']}\" changed since the checkpoint, starting over")
+                return 0
+            if os.stat(self.dst).st_size < offset:
+                log_out(f"[Checkpointer]: \"{self.dst}\" is shorter than its checkpoint, starting over")
+                return 0
+        except (OSError, ValueError, KeyError):
+            return 0
+
+        prefix_hasher = hashlib.blake2b()
+        hasher = self.hasher.copy() if self.hasher is not None else None  # Left untouched if the prefix is bad
+        with open(self.dst, "rb") as f:
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(buffer_size, remaining))
+                if not chunk:
+                    return 0
+                prefix_hasher.update(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                remaining -= len(chunk)
+        if prefix_hasher.hexdigest() != saved["digest"]:
+            log_out(f"[Checkpointer]: the copied part of \"{self.dst}\" does not match its checkpoint, starting over")
+            return 0
+        self.prefix_hasher, self.hasher = prefix_hasher, hasher
+        self.offset = self.saved_offset = offset
+        return offset
+
+
+class CopyProgress:  # Tracks copied bytes and reports progress only when the whole percentage changes
+    def __init__(self, size, progress_callback=None):
+        self.size = size
+        self.progress_callback = progress_callback
+        self.copied_bytes = 0
+        self.last_percent = -1
+
+    def advance(self, copied):
+        self.copied_bytes += copied
+        percent_complete = 100 * self.copied_bytes // self.size if self.size else 100
+        if percent_complete != self.last_percent:
+            self.last_percent = percent_complete
+            # Per-chunk progress lines are rate limited, the final one always gets through
+            log_out(f"[copy_file]: INFO: {percent_complete}% Complete ",
+                    rate_limit=None if percent_complete == 100 else "copy_file")
+            if self.progress_callback is not None:
+                self.progress_callback(percent_complete)
+
+    def finish(self):
+        if self.progress_callback is not None and self.last_percent != 100:
+            self.progress_callback(100)
+
+
+def copy_reflink(input_file, output_file, progress, buffer_size, cancel_event, hasher=None):
+    if fcntl is None or progress.copied_bytes:
+        return False
+    fcntl.ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+    progress.advance(progress.size)
+    return True
+
+
+def reflink_file(src, dst):  # Clones src into a new dst sharing its blocks, False (leaving no dst) where it cannot
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as input_file, open(dst, "wb") as output_file:
+            fcntl.ioctl(output_file.fileno(), FICLONE, input_file.fileno())
+    except OSError as e:
+        if os.path.exists(dst):
+            os.remove(dst)
+        if e.errno not in FALLBACK_ERRNOS:
+            raise
+        return False
+    return True
+
+
+def copy_range(input_file, output_file, progress, buffer_size, cancel_event, hasher=None):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    while progress.copied_bytes < progress.size and not cancel_event.is_set():
+        offset = progress.copied_bytes
+        copied = os.copy_file_range(input_file.fileno(), output_file.fileno(), buffer_size, offset, offset)
+        if not copied:  # Some filesystems (procfs, some FUSE mounts) report 0 instead of failing
+            return False
+        progress.advance(copied)
+        drop_cached(input_file, progress.copied_bytes)
+        drop_cached(output_file, progress.copied_bytes)
+    return True
+
+
+def copy_sendfile(input_file, output_file, progress, buffer_size, cancel_event, hasher=None):
+    if not hasattr(os, "sendfile"):
+        return False
+    os.lseek(output_file.fileno(), progress.copied_bytes, os.SEEK_SET)
+    while progress.copied_bytes < progress.size and not cancel_event.is_set():
+        copied = os.sendfile(output_file.fileno(), input_file.fileno(), progress.copied_bytes, buffer_size)
+        if not copied:
+            return False
+        progress.advance(copied)
+        drop_cached(input_file, progress.copied_bytes)
+        drop_cached(output_file, progress.copied_bytes)
+    return True
+
+
+def copy_buffered(input_file, output_file, progress, buffer_size, cancel_event, hasher=None):
+    input_file.seek(progress.copied_bytes)
+    output_file.seek(progress.copied_bytes)
+    buffer = bytearray(min(buffer_size, max(progress.size, 1)))
+    with memoryview(buffer) as view:
+        while not cancel_event.is_set():
+            read = input_file.readinto(buffer)
+            if not read:
+                break
+            output_file.write(view[:read])
+            if hasher is not None:  # Hash the bytes while they are in memory anyway, the copy is never read back
+                hasher.update(view[:read])
+            progress.advance(read)
+            drop_cached(input_file, progress.copied_bytes)
+            drop_cached(output_file, progress.copied_bytes)  # Not yet flushed ones are dropped by a later chunk
+    output_file.flush()
+    return True
+
+
+COPY_FUNCTIONS = {"reflink": copy_reflink,
+                  "copy_file_range": copy_range,
+                  "sendfile": copy_sendfile,
+                  "buffered": copy_buffered}
+
+
+def copy_file(src, dst, buffer_size=DEFAULT_BUFFER_SIZE, progress_callback=None, cancel_event=None,
+              methods=COPY_METHODS, hasher=None, expected_digest=None, durability=DEFAULT_DURABILITY, resume=False,
+              digest_callback=None):
+    # With resume set the copy saves checkpoints and a canceled or failed copy leaves dst behind to be resumed by
+    # the next copy_file of the same src and dst
+    # digest_callback gets the hex digest of everything copied, a resumed copy continues a copy of the hasher passed in
+    log_out(f"[copy_file]: copying \"{src}\" to \"{dst}\"")
+    if hasher is not None or resume:  # The kernel side methods never hand the bytes to Python to be hashed
+        methods = ("buffered",)
+
+    size = os.stat(src).st_size
+    buffer_size = clamp_buffer_size(buffer_size)
+    log_out(f"[copy_file]: file is {size} bytes, copying with a {buffer_size} byte buffer")
+
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    progress = CopyProgress(size, progress_callback)
+    checkpointer = Checkpointer(src, dst, hasher) if resume else None
+    offset = checkpointer.resume(buffer_size) if resume else 0
+    if offset:
+        log_out(f"[copy_file]: resuming at byte {offset} of {size}")
+
+    # Copy, trying each method in turn and falling back when the kernel or filesystem does not support it.
+    # Every method continues from progress.copied_bytes so a fallback part way through does not recopy anything.
+    try:
+        with open(src, 'rb') as input_file:
+            advise(input_file, FADV_SEQUENTIAL)
+            with open(dst, 'r+b' if offset else 'wb') as output_file:
+                if offset:
+                    output_file.truncate(offset)  # Anything after the checkpoint may not have been written whole
+                    progress.advance(offset)
+                preallocated = False
+                for method in methods:
+                    if method != "reflink" and not preallocated:  # A reflink shares the source's blocks instead
+                        preallocate(output_file, size)
+                        preallocated = True
+                    try:
+                        if COPY_FUNCTIONS[method](input_file, output_file, progress, buffer_size, cancel_event,
+                                                  checkpointer or hasher):
+                            log_out(f"[copy_file]: copied using {method}")
+                            break
+                    except OSError as e:
+                        if e.errno not in FALLBACK_ERRNOS:
+                            raise
+                        log_out(f"[copy_file]: {method} is not available here ({e.strerror}), falling back")
+                else:
+                    raise IOError(f"none of the copy methods {methods} could copy \"{src}\"")
+                if not cancel_event.is_set():
+                    sync_file(output_file, dst, durability)
+                    drop_cached(output_file, size)
+            drop_cached(input_file, size)
+        if cancel_event.is_set():
+            if checkpointer is not None and checkpointer.offset:
+                checkpointer.save()
+                log_out(f"[copy_file]: Canceled, keeping \"{dst}\" to resume at byte {checkpointer.offset}")
+                return False
+            log_out(f"[copy_file]: Canceled, removing \"{dst}\"")
+            os.remove(dst)
+            return False
+        if checkpointer is not None:
+            checkpointer.remove()
+            hasher = checkpointer.hasher  # Also holds the verified prefix when the copy was resumed
+        if hasher is not None and expected_digest is not None:
+            if hasher.hexdigest() != expected_digest.lower():
+                os.remove(dst)
+                raise IntegrityError(f"\"{src}\" does not match its {hasher.name} digest, "
+                                     f"expected {expected_digest} but got {hasher.hexdigest()}")
+            log_out(f"[copy_file]: verified {hasher.name} digest {expected_digest}")
+        if hasher is not None and digest_callback is not None:
+            digest_callback(hasher.hexdigest())
+        progress.finish()
+        return True
+
+    except IOError as e:
+        log_out(fg.red + f"\n[copy_file]: {e}" + Colors.reset, level=ERROR)
+        raise
@@ -0,0 +1,136 @@
+#! /bin/python3
+# Block level delta upgrades, only the blocks of the installed binary that differ from the new payload are written
+# A block manifest shipped next to the payload ("binary.blocks") lets unchanged blocks be skipped without reading
+# them from the payload at all, build it with:
+#   python3 delta.py binary
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+
+from copy_engine import reflink_file, sync_directory, sync_file, CopyProgress, IntegrityError, DEFAULT_DURABILITY
+from log import log_out
+
+DELTA_BLOCK_SIZE = 1024 * 1024  # 1 MiB
+BLOCK_DIGEST_SIZE = 16  # bytes of blake2b per block, collisions between two versions of a file are not a concern
+
+
+def block_digest(block):
+    return hashlib.blake2b(block, digest_size=BLOCK_DIGEST_SIZE).hexdigest()
+
+
+def block_digests(path, block_size=DELTA_BLOCK_SIZE):
+    digests = []
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digests.append(block_digest(block))
+    return digests
+
+
+def write_block_manifest(payload_path, block_size=DELTA_BLOCK_SIZE):
+    manifest = {"block_size": block_size, "size": os.stat(payload_path).st_size,
+                "blocks": block_digests(payload_path, block_size)}
+    with open(f"{payload_path}.blocks", "w") as f:
+        json.dump(manifest, f)
+    log_out(f"[write_block_manifest]: wrote {len(manifest['blocks'])} block digests for \"{payload_path}\"")
+
+
+def read_block_manifest(payload_path):  # Returns None when no manifest was shipped or it is out of date
+    try:
+        with open(f"{payload_path}.blocks") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("size") != os.stat(payload_path).st_size:
+        log_out(f"[read_block_manifest]: ignoring the block manifest of \"{payload_path}\", its size does not match")
+        return None
+    return manifest
+
+
+def delta_upgrade(src, dst, atomic=True, progress_callback=None, cancel_event=None, hasher=None,
+                  expected_digest=None, durability=DEFAULT_DURABILITY, target=None):
+    # With atomic set the installed file is cloned to a temporary file next to it, patched and renamed over dst, so
+    # a running binary is never modified and a cancel leaves the old version in place.
+    # Without it dst is patched in place, which is cheaper but leaves a mixed file behind if it is interrupted.
+    # With a target the patched clone is written there and left for the caller to rename, dst is only read.
+    # The clone must be a reflink, a full copy of the installed file costs more than copying the payload. Returns None
+    # when the filesystem cannot reflink, the caller then copies the payload instead.
+    log_out(f"[delta_upgrade]: upgrading \"{dst}\" from \"{src}\"")
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    manifest = read_block_manifest(src)
+    block_size = manifest["block_size"] if manifest else DELTA_BLOCK_SIZE
+    size = os.stat(src).st_size
+
+    staged = target is not None
+    if not staged:
+        target = f"{dst}.upgrade-tmp" if atomic else dst
+    cloned = target != dst  # A clone is removed again on a cancel or an error
+    if cloned and not reflink_file(dst, target):
+        log_out(f"[delta_upgrade]: \"{dst}\" cannot be reflinked here, a plain copy is cheaper")
+        return None
+
+    progress = CopyProgress(size, progress_callback)
+    changed_blocks = 0
+    try:
+        # The installed blocks are read from dst, the clone shares them and is only written to
+        with open(src, "rb") as input_file, open(dst, "rb") as installed_file, open(target, "r+b") as output_file:
+            for index, offset in enumerate(range(0, size, block_size)):
+                if cancel_event.is_set():
+                    break
+                installed_file.seek(offset)
+                installed_block = installed_file.read(block_size)
+                if manifest:
+                    changed = block_digest(installed_block) != manifest["blocks"][index]
+                    new_block = None
+                else:
+                    input_file.seek(offset)
+                    new_block = input_file.read(block_size)
+                    changed = new_block != installed_block
+                if changed:
+                    if new_block is None:
+                        input_file.seek(offset)
+                        new_block = input_file.read(block_size)
+                    output_file.seek(offset)
+                    output_file.write(new_block)
+                    changed_blocks += 1
+                if hasher is not None:
+                    hasher.update(new_block if changed else installed_block)
+                progress.advance(min(block_size, size - offset))
+            output_file.truncate(size)
+            if not cancel_event.is_set():  # The directory is synced after the rename below
+                sync_file(output_file, target, "fsync" if durability == "fsync+dir" else durability)
+
+        if cancel_event.is_set():
+            log_out("[delta_upgrade]: Canceled")
+            if cloned:
+                os.remove(target)
+            return False
+        if hasher is not None and expected_digest is not None and hasher.hexdigest() != expected_digest.lower():
+            raise IntegrityError(f"\"{dst}\" does not match the {hasher.name} digest of \"{src}\" after the upgrade")
+        if cloned and not staged:
+            os.replace(target, dst)
+            if durability == "fsync+dir":
+                sync_directory(os.path.dirname(dst))
+    except IOError:
+        if cloned and os.path.exists(target):
+            os.remove(target)
+        raise
+
+    log_out(f"[delta_upgrade]: rewrote {changed_blocks} of {math.ceil(size / block_size)} blocks "
+            f"({block_size} bytes each)")
+    progress.finish()
+    return True
+
+
+def main():
+    for payload_path in sys.argv[1:]:
+        write_block_manifest(payload_path)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,105 @@
+# Installs without the Qt wizard (and without importing Qt at all), for build and render nodes with no display
+# Run through main.py, for example:
+#   python3 main.py --headless --for-me --menu-entry
+import asyncio
+import os
+import signal
+import sys
+import threading
+
+from colors import Colors
+from install_pipeline import install_pipeline
+from log import log_out, open_log, close_log, set_terminal_output, ERROR
+from preflight import preflight
+from throughput import Throughput
+from program import (install_prefix, run_program, PROGRAM_NAME, VERSION, LOG_PATH, COPY_BUFFER_SIZE,
+                     DESKTOP_SHORTCUT_PATH, MENU_SHORTCUT_PATH)
+
+fg, bg = Colors.Foreground, Colors.Background
+
+
+class ProgressBar:  # Redraws a single terminal line, or prints every 10% when the output is not a terminal
+    def __init__(self, width=40, stream=sys.stderr, total_bytes=None):
+        self.width = width
+        self.stream = stream
+        self.throughput = Throughput(total_bytes) if total_bytes else None  # Adds MB/s and time left
+        self.interactive = stream.isatty()
+        self.last_step = -1
+        self.lock = threading.Lock()  # The install workers report progress from several threads
+
+    def draw(self, percent):
+        with self.lock:
+            if self.throughput is not None:
+                self.throughput.update_percent(percent)
+            rate = f"  {self.throughput.describe()}".rstrip() if self.throughput is not None else ""
+            if self.interactive:
+                filled = self.width * percent // 100
+                self.stream.write(f"\r{fg.green}[{'#' * filled}{'.' * (self.width - filled)}]{Colors.reset} "
+                                  f"{percent:3}%{rate}\033[K")
+                if percent == 100:
+                    self.stream.write("\n")
+                self.stream.flush()
+            elif percent // 10 != self.last_step:
+                self.last_step = percent // 10
+                self.stream.write(f"{percent}%{rate}\n")
+                self.stream.flush()
+
+
+def run_headless(arguments):
+    open_log(LOG_PATH)
+    set_terminal_output(False)  # Everything still goes to the log file, the terminal only shows the progress bar
+    for_everyone = os.geteuid() == 0 if arguments.for_everyone is None else arguments.for_everyone
+    if for_everyone and os.geteuid() != 0:
+        print(fg.red + "Installing for everyone requires root, retry as root or use --for-me" + Colors.reset)
+        return 1
+
+    prefix = install_prefix(for_everyone)
+    print(f"Installing {PROGRAM_NAME} {VERSION} into {prefix}, logging to {LOG_PATH}")
+    preflight_result = preflight(for_everyone)  # Reports a full disk or a read only prefix before copying anything
+    if preflight_result.problems:
+        for problem in preflight_result.problems:
+            log_out(fg.red + f"[run_headless]: {problem}" + Colors.reset, level=ERROR)
+            print(fg.red + f"Cannot install: {problem}" + Colors.reset)
+        close_log()
+        return 1
+    entries = preflight_result.entries
+    if preflight_result.installed_version is not None:
+        print(f"Replacing the installed {PROGRAM_NAME} {preflight_result.installed_version}")
+
+    progress_bar = ProgressBar(total_bytes=sum(entry.size for entry in entries))
+    shortcuts = [path for path, wanted in ((DESKTOP_SHORTCUT_PATH, arguments.desktop_entry),
+                                           (MENU_SHORTCUT_PATH, arguments.menu_entry)) if wanted]
+
+    async def install():  # Ctrl+C cancels the pipeline, which stops the copy cleanly between chunks
+        task = asyncio.current_task()
+
+        def cancel():
+            print("\nCanceling...")
+            task.cancel()
+
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, cancel)
+        return await install_pipeline(entries, prefix, shortcuts=shortcuts,
+                                      progress_callback=progress_bar.draw, buffer_size=COPY_BUFFER_SIZE,
+                                      durability=arguments.durability)
+
+    try:
+        completed = asyncio.run(install())
+    except asyncio.CancelledError:
+        completed = False
+    except (IOError, ValueError) as e:
+        log_out(fg.red + f"[run_headless]: {e}" + Colors.reset, level=ERROR)
+        print(fg.red + f"\nInstallation failed: {e}" + Colors.reset)
+        close_log()
+        return 1
+    if not completed:
+        log_out("[run_headless]: Installation canceled")
+        print("Installation canceled")
+        close_log()
+        return 130
+
+    log_out("[run_headless]: Installed")
+    print(fg.green + f"Installed {PROGRAM_NAME} {VERSION}" + Colors.reset)
+    close_log()
+    if arguments.launch:
+        run_program()
+    return 0
@@ -0,0 +1,197 @@
+#! /bin/python3
+# Pre-rasterized PNGs of the SVG page images at the common device pixel ratios, so showing a page on a HiDPI screen
+# does not have to render its SVG first. Run this file as a build step to render every SVG in Resources.qrc:
+#   python3 icon_cache.py
+# load_icon() picks the PNG for the screen's device pixel ratio and renders the SVG (caching the result for the next
+# launch) when there is none. Rendered images are named by the SVG's hash and size so a changed icon is never stale
+# An index records each SVG's hash and size with the modification time the .rcc stores for it, so finding the PNG
+# needs neither reading nor parsing the SVG, it is only loaded on a cache miss
+import hashlib
+import json
+import os
+import sys
+
+from PyQt5.QtCore import QByteArray, QFile, QIODevice, QResource, Qt
+from PyQt5.QtGui import QImage, QPainter, QPixmap, QPixmapCache
+
+from colors import Colors
+from log import log_out
+from program import get_path
+from resources import resource_files, resource_mtime_ms, RESOURCE_COLLECTION
+
+try:
+    from PyQt5.QtSvg import QSvgRenderer
+except ModuleNotFoundError:  # Optional, without it the SVG is loaded through QPixmap at its 1x size
+    QSvgRenderer = None
+
+fg, bg = Colors.Foreground, Colors.Background
+
+ICON_SCALES = (1.0, 1.25, 1.5, 2.0)
+ICON_CACHE_DIRS = (get_path("icon_cache"), os.path.expanduser("~/.cache/qt-installer/icons"))
+ICON_INDEX = "index.json"  # {resource path: {"modified_ms", "hash", "width", "height"}} in each cache directory
+icon_index = None  # Every cache directory's index merged, loaded on first use
+
+
+def icon_scale(device_pixel_ratio):  # The smallest prerendered scale that is still sharp on this screen
+    for scale in ICON_SCALES:
+        if scale >= device_pixel_ratio - 0.01:
+            return scale
+    return device_pixel_ratio  # Above 2x, render at the exact ratio
+
+
+def svg_hash(svg_data):
+    return hashlib.sha256(svg_data).hexdigest()[:16]
+
+
+def icon_name(svg_hash, width, height, scale):
+    return f"{svg_hash}-{width}x{height}@{round(scale * 100)}.png"
+
+
+def load_index():
+    global icon_index
+    if icon_index is None:
+        icon_index = {}
+        for directory in reversed(ICON_CACHE_DIRS):  # Entries in the first directory win
+            try:
+                with open(os.path.join(directory, ICON_INDEX)) as f:
+                    icon_index.update(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return icon_index
+
+
+def save_index_entry(resource_path, entry):  # Into the first cache directory we can write to
+    load_index()[resource_path] = entry
+    for directory in ICON_CACHE_DIRS:
+        path = os.path.join(directory, ICON_INDEX)
+        try:
+            try:
+                with open(path) as f:
+                    index = json.load(f)
+            except (FileNotFoundError, ValueError):
+                index = {}
+            index[resource_path] = entry
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(path + ".tmp", path)
+            return path
+        except OSError as e:
+            log_out(f"[save_index_entry]: could not write \"{path}\": {e}")
+    return None
+
+
+def indexed_entry(resource_path):  # The index entry if it still describes the registered resource, else None
+    entry = load_index().get(resource_path)
+    if entry is None:
+        return None
+    modified = QResource(resource_path).lastModified()
+    if not modified.isValid() or modified.toMSecsSinceEpoch() != entry["modified_ms"]:
+        return None
+    return entry
+
+
+def find_icon(name, scale):  # The prerendered PNG from memory or disk, or None
+    pixmap = QPixmapCache.find(name)
+    if pixmap is not None and not pixmap.isNull():
+        return pixmap
+    for directory in ICON_CACHE_DIRS:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            pixmap = QPixmap(path)
+            if not pixmap.isNull():
+                pixmap.setDevicePixelRatio(scale)
+                QPixmapCache.insert(name, pixmap)
+                return pixmap
+    return None
+
+
+def render_svg(renderer, size, scale):
+    image = QImage(round(size.width() * scale), round(size.height() * scale), QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    renderer.render(painter)
+    painter.end()
+    image.setDevicePixelRatio(scale)
+    return image
+
+
+def save_icon(image, name):  # Into the first cache directory we can write to, returns the path or None
+    for directory in ICON_CACHE_DIRS:
+        path = os.path.join(directory, name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if not image.save(path + ".tmp", "PNG"):
+                raise OSError("could not encode the PNG")
+            os.replace(path + ".tmp", path)
+            return path
+        except OSError as e:
+            log_out(f"[save_icon]: could not write \"{path}\": {e}")
+    return None
+
+
+def read_resource(resource_path):
+    resource = QFile(resource_path)
+    if not resource.open(QIODevice.ReadOnly):
+        return None
+    svg_data = bytes(resource.readAll())
+    resource.close()
+    return svg_data
+
+
+def load_icon(resource_path, device_pixel_ratio=1.0):
+    scale = icon_scale(device_pixel_ratio)
+    entry = indexed_entry(resource_path)
+    if entry is not None:  # The common case, the SVG is not even read
+        pixmap = find_icon(icon_name(entry["hash"], entry["width"], entry["height"], scale), scale)
+        if pixmap is not None:
+            return pixmap
+
+    svg_data = read_resource(resource_path)
+    if svg_data is None or QSvgRenderer is None:
+        return QPixmap(resource_path)
+    renderer = QSvgRenderer(QByteArray(svg_data))
+    size = renderer.defaultSize()
+    name = icon_name(svg_hash(svg_data), size.width(), size.height(), scale)
+    pixmap = find_icon(name, scale)
+    if pixmap is None:
+        log_out(f"[load_icon]: no prerendered \"{resource_path}\" at {scale}x, rendering the SVG")
+        image = render_svg(renderer, size, scale)
+        save_icon(image, name)
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(name, pixmap)
+    modified = QResource(resource_path).lastModified()
+    if entry is None and modified.isValid():  # Lets the next launch find the PNG without parsing the SVG
+        save_index_entry(resource_path, {"modified_ms": modified.toMSecsSinceEpoch(), "hash": svg_hash(svg_data),
+                                         "width": size.width(), "height": size.height()})
+    return pixmap
+
+
+def main():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # The build step must not need a display
+    from PyQt5.QtGui import QGuiApplication
+    app = QGuiApplication(sys.argv[:1])
+
+    if QSvgRenderer is None:
+        print(fg.red + "Rendering the icons needs the PyQt5.QtSvg module" + Colors.reset)
+        return 1
+    for resource_path, path in resource_files(get_path(RESOURCE_COLLECTION)).items():
+        if not path.endswith(".svg"):
+            continue
+        with open(path, "rb") as f:
+            svg_data = f.read()
+        renderer = QSvgRenderer(QByteArray(svg_data))
+        size = renderer.defaultSize()
+        for scale in ICON_SCALES:
+            icon_path = save_icon(render_svg(renderer, size, scale),
+                                  icon_name(svg_hash(svg_data), size.width(), size.height(), scale))
+            log_out(f"[icon_cache]: rendered \"{path}\" at {scale}x to \"{icon_path}\"")
+        # The .rcc records the same modification time, load_icon() compares the two
+        save_index_entry(f":/{resource_path}", {"modified_ms": resource_mtime_ms(path), "hash": svg_hash(svg_data),
+                                                "width": size.width(), "height": size.height()})
+    del app
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
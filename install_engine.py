@@ -0,0 +1,180 @@
+# Installs every file listed in a JSON manifest, copying them concurrently on a bounded thread pool
+# A manifest next to the payload looks like this, destinations may use {prefix}, {bin} and {share}:
+#   {"files": [{"source": "binary", "destination": "{bin}/ip-geo", "mode": "744", "digest": "sha256:<hex>"},
+#              {"source": "icons/ip-geo.svg", "destination": "{share}/icons/ip-geo.svg"}]}
+# A mode is an octal string or a JSON number, without one files get 644
+# Without a digest the file is checked against a digest file shipped next to it, if there is one
+# Sources ending in .zst, .xz or .gz are decompressed into the destination, their digest is of the decompressed file
+# Files are staged next to their destinations and only renamed into place once all of them are ready, see
+# install_journal.py
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from compression import compression_of, decompress_file, uncompressed_path
+from copy_engine import (checkpoint_path, copy_file, new_hash, read_payload_digest, DEFAULT_BUFFER_SIZE,
+                         DEFAULT_DURABILITY)
+from delta import delta_upgrade
+from install_journal import remove_if_exists, staged_path, InstallJournal
+from log import log_out
+
+MANIFEST_NAME = "manifest.json"
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)  # Copies are I/O bound, a few more threads than cores is plenty
+DEFAULT_MODE = 0o644
+RECEIPT_ALGORITHM = "blake2b"  # For the receipt, when a file without a shipped digest is read in Python anyway
+# Files at least this large are copied resumably, an interrupted install continues where it stopped instead of
+# starting over. Smaller ones keep the faster kernel side copy methods unless they have a digest to verify, see
+# copy_file
+RESUMABLE_SIZE = 256 * 1024 * 1024  # 256 MiB
+
+
+class ManifestEntry:
+    def __init__(self, source, destination, mode=DEFAULT_MODE, algorithm=None, digest=None):
+        self.source = source
+        self.destination = destination
+        self.mode = mode
+        self.algorithm = algorithm
+        self.digest = digest
+        self.size = os.stat(source).st_size
+        self.installed_digest = None  # (algorithm, hex digest) of the installed file, recorded while it is written
+
+
+def install_variables(prefix):
+    return {"prefix": prefix, "bin": os.path.join(prefix, "bin"), "share": os.path.join(prefix, "share")}
+
+
+def parse_mode(mode):  # An octal string like "744", or the mode as a JSON number (493 is 0o755)
+    if isinstance(mode, int) and not isinstance(mode, bool):
+        value = mode
+    elif isinstance(mode, str):
+        try:
+            value = int(mode, 8)
+        except ValueError:
+            raise ValueError(f"the mode \"{mode}\" is not an octal number") from None
+    else:
+        raise ValueError(f"the mode {mode!r} is neither an octal string nor a number")
+    if not 0 <= value <= 0o7777:
+        raise ValueError(f"the mode {mode!r} is out of range")
+    return value
+
+
+def load_manifest(manifest_path, variables):
+    directory = os.path.dirname(os.path.realpath(manifest_path))
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    entries = []
+    for file in manifest["files"]:
+        source = os.path.join(directory, file["source"])
+        if "digest" in file:
+            algorithm, digest = file["digest"].split(":", 1)
+        else:
+            algorithm, digest = read_payload_digest(uncompressed_path(source))
+        entries.append(ManifestEntry(source, file["destination"].format(**variables),
+                                     parse_mode(file.get("mode", DEFAULT_MODE)), algorithm, digest))
+    return entries
+
+
+class AggregateProgress:  # Combines the per-file percentages into one percentage weighted by file size
+    def __init__(self, entries, progress_callback=None):
+        self.total = sum(entry.size for entry in entries)
+        self.copied = {}  # destination -> bytes copied so far
+        self.progress_callback = progress_callback
+        self.last_percent = -1
+        self.lock = threading.Lock()
+
+    def file_callback(self, entry):
+        def update(percent):
+            with self.lock:
+                self.copied[entry.destination] = entry.size * percent // 100
+                percent_complete = 100 * sum(self.copied.values()) // self.total if self.total else 100
+                if percent_complete == self.last_percent:
+                    return
+                self.last_percent = percent_complete
+            if self.progress_callback is not None:
+                self.progress_callback(percent_complete)
+        return update
+
+
+def install_entry(entry, progress, cancel_event, buffer_size=DEFAULT_BUFFER_SIZE,
+                  durability=DEFAULT_DURABILITY):
+    # Writes, verifies and chmods the staged copy of the entry, the journal renames it over the destination
+    os.makedirs(os.path.dirname(entry.destination), exist_ok=True)
+    staged = staged_path(entry.destination)
+    # A decompressed, patched or resumable copy reads every byte in Python, it is hashed for the receipt on the way.
+    # A plain copy is only hashed to verify a shipped digest, otherwise it keeps the kernel side copy methods and the
+    # receipt records no digest for it
+    algorithm = entry.algorithm or RECEIPT_ALGORITHM
+    entry.installed_digest = None  # The entries may be reused by a retried install
+
+    def record_digest(digest):
+        entry.installed_digest = (algorithm, digest)
+
+    resume = entry.size >= RESUMABLE_SIZE and not compression_of(entry.source)
+    if not resume:  # Left behind by an earlier attempt that could resume, this one starts from scratch
+        remove_if_exists(checkpoint_path(staged))
+    if compression_of(entry.source):  # Progress and the pool's byte weighting use the compressed size
+        hasher = new_hash(algorithm)
+        completed = decompress_file(entry.source, staged, buffer_size=buffer_size,
+                                    progress_callback=progress.file_callback(entry), cancel_event=cancel_event,
+                                    hasher=hasher, expected_digest=entry.digest, durability=durability)
+        if completed:
+            record_digest(hasher.hexdigest())
+    else:
+        completed = None
+        if os.path.exists(entry.destination) and not os.path.exists(checkpoint_path(staged)):
+            # None when the installed file cannot be reflinked, patching a full copy of it is slower than copying
+            hasher = new_hash(algorithm)
+            completed = delta_upgrade(entry.source, entry.destination,
+                                      progress_callback=progress.file_callback(entry), cancel_event=cancel_event,
+                                      hasher=hasher, expected_digest=entry.digest, durability=durability,
+                                      target=staged)
+            if completed:
+                record_digest(hasher.hexdigest())
+    if completed is None:
+        completed = copy_file(entry.source, staged, buffer_size=buffer_size,
+                              progress_callback=progress.file_callback(entry), cancel_event=cancel_event,
+                              hasher=new_hash(algorithm) if entry.digest is not None or resume else None,
+                              expected_digest=entry.digest, durability=durability, resume=resume,
+                              digest_callback=record_digest)
+    if completed:
+        os.chmod(staged, entry.mode)
+    return completed
+
+
+def install_manifest(entries, prefix, progress_callback=None, cancel_event=None, max_workers=MAX_WORKERS,
+                     buffer_size=DEFAULT_BUFFER_SIZE, durability=DEFAULT_DURABILITY):
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    progress = AggregateProgress(entries, progress_callback)
+    journal = InstallJournal(prefix, [entry.destination for entry in entries], durability)
+    journal.begin()  # Finishes or rolls back an earlier install of the same files that was interrupted
+    log_out(f"[install_manifest]: installing {len(entries)} files ({progress.total} bytes) "
+            f"with {max_workers} workers")
+
+    # Largest files are started first so they are not left running alone at the end, the small files then fill
+    # whichever workers are free instead of queueing behind a large file
+    ordered = sorted(entries, key=lambda entry: entry.size, reverse=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(install_entry, entry, progress, cancel_event, buffer_size, durability)
+                   for entry in ordered]
+        error = None
+        for future in futures:
+            try:
+                future.result()
+            except (IOError, ValueError) as e:
+                if error is None:  # Stop the other workers, the first error is the one reported
+                    error = e
+                    cancel_event.set()
+    if error is not None or cancel_event.is_set():  # Nothing was renamed yet, the installed files are untouched
+        journal.rollback()
+    if error is not None:
+        raise error
+    if cancel_event.is_set():
+        log_out("[install_manifest]: Canceled")
+        return False
+    journal.commit()
+    if progress_callback is not None and progress.last_percent != 100:
+        progress_callback(100)
+    return True
@@ -0,0 +1,133 @@
+# Staged installs: every file is written to a temporary file next to its destination, verified and chmodded there,
+# and only renamed over the destination once every file of the install is ready, so a running binary is never half
+# written. The journal records each rename, an install interrupted while renaming is finished on the next run and one
+# interrupted before that is rolled back, either way the next install starts from a consistent set of files.
+import hashlib
+import json
+import os
+
+from copy_engine import checkpoint_path, copy_file, sync_directory, DEFAULT_DURABILITY
+from log import log_out
+
+
+def staged_path(destination):  # Same directory as the destination so the final rename never crosses filesystems
+    directory, name = os.path.split(destination)
+    return os.path.join(directory, f".{name}.install-tmp")
+
+
+def backup_path(destination):
+    directory, name = os.path.split(destination)
+    return os.path.join(directory, f".{name}.install-backup")
+
+
+def journal_path(prefix, destinations):  # The same set of destinations always gets the same journal
+    # Kept inside the prefix, next to its receipt, so whoever installs into the prefix next finds it whatever their
+    # HOME is, and a chroot's journal stays in the chroot
+    key = hashlib.sha256("\n".join(sorted(destinations)).encode()).hexdigest()[:16]
+    return os.path.join(prefix, "share", "qt-installer", "journals", f"{key}.json")
+
+
+def remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def make_backup(destination, backup):  # A hard link costs nothing, filesystems without them get a copy
+    remove_if_exists(backup)
+    try:
+        os.link(destination, backup)
+    except OSError:
+        copy_file(destination, backup)
+
+
+class InstallJournal:
+    def __init__(self, prefix, destinations, durability=DEFAULT_DURABILITY, path=None):
+        self.path = path or journal_path(prefix, destinations)
+        self.durability = durability
+        self.state = "staging"  # "staging" while the files are written, "committing" while they are renamed
+        self.files = [{"destination": destination, "backup": None, "committed": False}
+                      for destination in destinations]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            saved = json.load(f)
+        journal = cls(None, [], saved.get("durability", DEFAULT_DURABILITY), path)
+        journal.state = saved["state"]
+        journal.files = saved["files"]
+        return journal
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"state": self.state, "durability": self.durability, "files": self.files}, f)
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def begin(self):  # Deals with whatever an interrupted install with the same files left behind, then starts
+        if os.path.exists(self.path):
+            try:
+                InstallJournal.load(self.path).recover()
+            except (OSError, ValueError, KeyError) as e:
+                log_out(f"[InstallJournal]: ignoring the unreadable journal \"{self.path}\": {e}")
+        self.save()
+
+    def recover(self):
+        if self.state == "committing":  # Every file was staged and verified, finish putting them in place
+            log_out(f"[InstallJournal]: finishing the interrupted install recorded in \"{self.path}\"")
+            for file in self.files:
+                if not file["committed"] and os.path.exists(staged_path(file["destination"])):
+                    self.commit_file(file)
+            self.finish()
+        else:
+            log_out(f"[InstallJournal]: rolling back the interrupted install recorded in \"{self.path}\"")
+            self.rollback()
+
+    def commit_file(self, file):
+        destination = file["destination"]
+        if os.path.exists(destination):  # Kept until every file is in place so a failed commit can be undone
+            make_backup(destination, backup_path(destination))
+            file["backup"] = backup_path(destination)
+        os.replace(staged_path(destination), destination)
+        file["committed"] = True
+        self.save()
+
+    def commit(self):
+        self.state = "committing"
+        self.save()
+        try:
+            for file in self.files:
+                self.commit_file(file)
+            if self.durability == "fsync+dir":
+                for directory in sorted({os.path.dirname(file["destination"]) for file in self.files}):
+                    sync_directory(directory)
+        except OSError as e:
+            log_out(f"[InstallJournal]: could not put the files in place, rolling back: {e}")
+            self.rollback()
+            raise
+        log_out(f"[InstallJournal]: installed {len(self.files)} files")
+        self.finish()
+
+    def rollback(self):
+        # Puts back every file the install replaced and removes everything it added, except for staged copies with a
+        # checkpoint, the next install resumes those
+        for file in reversed(self.files):
+            destination = file["destination"]
+            if file["committed"]:
+                if file["backup"] is not None:
+                    os.replace(file["backup"], destination)
+                else:
+                    remove_if_exists(destination)
+                file["committed"] = False
+            if not os.path.exists(checkpoint_path(staged_path(destination))):
+                remove_if_exists(staged_path(destination))
+        self.finish()
+
+    def finish(self):
+        for file in self.files:
+            remove_if_exists(backup_path(file["destination"]))
+        remove_if_exists(self.path)
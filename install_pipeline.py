@@ -0,0 +1,55 @@
+# The install as asyncio stages so independent steps overlap their waits: the copy (which verifies, chmods and
+# renames the files into place on the engine's worker threads) runs while the shortcuts are written, post-install
+# hooks run once every file is in place. Cancelling the task is cooperative, the copy stops between chunks and the
+# shortcuts the pipeline added are removed again before the cancel is passed on.
+# The wizard runs this on the Qt event loop through qasync, the headless installer with asyncio.run()
+import asyncio
+import inspect
+import os
+import threading
+
+from copy_engine import DEFAULT_BUFFER_SIZE, DEFAULT_DURABILITY
+from install_engine import install_manifest, MAX_WORKERS
+from install_journal import remove_if_exists
+from log import log_out
+from program import write_shortcut
+from receipts import write_receipt
+
+
+async def run_hooks(hooks):  # Plain callables run on a thread, coroutine functions are awaited
+    for hook in hooks:
+        log_out(f"[run_hooks]: running {getattr(hook, '__name__', hook)}")
+        if inspect.iscoroutinefunction(hook):
+            await hook()
+        else:
+            await asyncio.to_thread(hook)
+
+
+async def install_pipeline(entries, prefix, shortcuts=(), post_install=(), progress_callback=None,
+                           buffer_size=DEFAULT_BUFFER_SIZE, durability=DEFAULT_DURABILITY):
+    cancel_event = threading.Event()
+    new_shortcuts = [path for path in shortcuts if not os.path.exists(path)]  # Only these are removed on failure
+    copy = asyncio.ensure_future(asyncio.to_thread(install_manifest, entries, prefix, progress_callback,
+                                                   cancel_event, MAX_WORKERS, buffer_size, durability))
+    try:
+        # The shortcuts do not depend on the copied bytes, they are written while the copy is still running
+        await asyncio.gather(*(asyncio.to_thread(write_shortcut, path) for path in shortcuts))
+        # Shielded, cancelling this task must not cancel the future of a copy whose thread keeps running
+        completed = await asyncio.shield(copy)
+    except BaseException as e:  # Canceled, or a stage failed: stop the copy and wait until install_manifest returns
+        log_out(f"[install_pipeline]: stopping the install: {type(e).__name__}: {e}")
+        cancel_event.set()
+        await asyncio.wait([copy])  # The engine stops between chunks and rolls its journal back before returning
+        if not copy.cancelled() and copy.exception() is not None and copy.exception() is not e:
+            log_out(f"[install_pipeline]: the copy also failed: {copy.exception()}")
+        for path in new_shortcuts:
+            remove_if_exists(path)
+        raise
+
+    if not completed:
+        for path in new_shortcuts:
+            remove_if_exists(path)
+        return False
+    await asyncio.to_thread(write_receipt, prefix, entries)  # Lets the next launch recognise this install
+    await run_hooks(post_install)
+    return True
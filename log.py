@@ -0,0 +1,123 @@
+# Shared log output for the installer, everything written here goes to the terminal and to the log file
+# Records are queued and written in batches by a background thread so slow terminals or a slow /tmp never hold up
+# the caller, close_log() (also run at exit) makes sure everything queued reaches the log file
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+LOG_LEVEL = LEVELS.get(os.environ.get("INSTALLER_LOG_LEVEL", "INFO").upper(), INFO)  # Records below this are dropped
+FLUSH_INTERVAL = 0.5  # seconds, the writer flushes at least this often while there is output pending
+BATCH_SIZE = 512  # records written per batch at most
+RATE_LIMIT_INTERVAL = 0.25  # seconds between two records sharing the same rate_limit key
+
+LOG_FILE_OBJECT = None
+TERMINAL_OUTPUT = True  # The headless installer turns this off and draws a progress bar instead
+log_queue = queue.SimpleQueue()
+writer_thread = None
+writer_lock = threading.Lock()
+rate_limited = {}  # rate_limit key -> time the last record with that key was queued
+
+
+class FlushRequest:  # Queued by flush_log(), the writer sets the event once everything before it is written
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def write_records():  # Body of the writer thread
+    pending = False
+    while True:
+        try:
+            records = [log_queue.get(timeout=FLUSH_INTERVAL if pending else None)]
+        except queue.Empty:  # Nothing new for a while, flush what has been written so far
+            flush_outputs()
+            pending = False
+            continue
+        while len(records) < BATCH_SIZE:
+            try:
+                records.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        text = "".join(record for record in records if isinstance(record, str))
+        if text:
+            if TERMINAL_OUTPUT:
+                sys.stdout.write(text)
+            if LOG_FILE_OBJECT is not None:
+                LOG_FILE_OBJECT.write(text)
+            pending = True
+
+        requests = [record for record in records if not isinstance(record, str)]
+        if requests:
+            flush_outputs()
+            pending = False
+            for request in requests:
+                if request is not None:
+                    request.done.set()
+            if None in requests:  # Sentinel from close_log()
+                return
+
+
+def flush_outputs():
+    sys.stdout.flush()
+    if LOG_FILE_OBJECT is not None:
+        LOG_FILE_OBJECT.flush()
+
+
+def start_writer():
+    global writer_thread
+    with writer_lock:
+        if writer_thread is None or not writer_thread.is_alive():
+            writer_thread = threading.Thread(target=write_records, name="log-writer", daemon=True)
+            writer_thread.start()
+
+
+def open_log(path):
+    global LOG_FILE_OBJECT
+    flush_log()
+    LOG_FILE_OBJECT = open(path, "a")
+
+
+def set_terminal_output(enabled):  # Records still go to the log file when the terminal output is off
+    global TERMINAL_OUTPUT
+    flush_log()
+    TERMINAL_OUTPUT = enabled
+
+
+def flush_log():  # Block until everything logged so far has been written out
+    if writer_thread is None or not writer_thread.is_alive():
+        return
+    request = FlushRequest()
+    log_queue.put(request)
+    request.done.wait()
+
+
+def close_log():
+    global LOG_FILE_OBJECT, writer_thread
+    if writer_thread is not None and writer_thread.is_alive():
+        log_queue.put(None)
+        writer_thread.join()
+    writer_thread = None
+    if LOG_FILE_OBJECT is not None:
+        LOG_FILE_OBJECT.close()
+        LOG_FILE_OBJECT = None
+
+
+def log_out(string, end="\n", level=INFO, rate_limit=None):
+    if level < LOG_LEVEL:
+        return
+    if rate_limit is not None:  # Drop records that come in faster than RATE_LIMIT_INTERVAL for the same key
+        now = time.monotonic()
+        if now - rate_limited.get(rate_limit, -RATE_LIMIT_INTERVAL) < RATE_LIMIT_INTERVAL:
+            return
+        rate_limited[rate_limit] = now
+    if writer_thread is None:
+        start_writer()
+    log_queue.put(string + end)
+
+
+atexit.register(close_log)
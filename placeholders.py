@@ -0,0 +1,26 @@
+# Text substitution for the {placeholders} in the UI, kept free of Qt so it can be benchmarked on its own
+# A text is compiled once into a template (literal text and placeholder keys), rendering a template is then a single
+# join instead of one str.replace pass over the whole text per key
+import re
+from functools import lru_cache
+
+# Only {identifier} is a placeholder, so CSS such as "p, li { white-space: pre-wrap; }" in rich text is left alone
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+@lru_cache(maxsize=512)
+def compile_template(text):  # ("literal", "key", "literal", "key", ..., "literal")
+    return tuple(PLACEHOLDER_PATTERN.split(text))
+
+
+def has_placeholders(template):
+    return len(template) > 1
+
+
+def render(template, substitutions):  # Unknown keys are kept as they are
+    return "".join(part if index % 2 == 0 else substitutions.get(part, "{" + part + "}")
+                   for index, part in enumerate(template))
+
+
+def substitute(text, substitutions):
+    return render(compile_template(text), substitutions)
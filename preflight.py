@@ -0,0 +1,117 @@
+# Checks an install target before anything is copied: free space on every filesystem the install writes to, whether
+# the destination directories can be written, which version is already installed there (from its receipt, nothing is
+# hashed) and which shortcuts exist. The wizard scans both targets, and every other prefix an earlier install may be
+# in, on background threads at launch, so the results are normally ready by the time the install page opens and a
+# full disk or a read only prefix is reported before the first byte is copied
+import os
+import threading
+
+from log import log_out, WARNING
+from program import install_prefix, payload_entries, DESKTOP_SHORTCUT_PATH, MENU_SHORTCUT_PATH
+from receipts import detection_prefixes, find_install
+
+
+class PreflightResult:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.entries = []  # The payload entries for this prefix, reused by the install
+        self.installed = False  # Whether the program is already installed in the prefix, with or without a receipt
+        self.installed_version = None  # From the prefix's install receipt, if its files are still as installed
+        self.problems = []  # Any of these stops the install
+        self.free_space = {}  # {directory: free bytes on its filesystem}
+        self.shortcuts = {}  # {path: True if it exists, False if it can be created, None if it cannot}
+
+
+def existing_parent(path):  # The nearest directory of path that exists, the install creates the ones below it
+    directory = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(directory):
+        directory = os.path.dirname(directory)
+    return directory
+
+
+def shortcut_state(path):
+    if os.path.exists(path):
+        return True
+    return False if os.access(existing_parent(path), os.W_OK | os.X_OK) else None  # Its directory is created if needed
+
+
+def preflight(for_everyone):
+    result = PreflightResult(install_prefix(for_everyone))
+    result.installed, result.installed_version = find_install(result.prefix)
+    try:
+        result.entries = payload_entries(result.prefix)
+    except (IOError, ValueError, KeyError) as e:
+        result.problems.append(f"could not read the install manifest: {e}")
+        return result
+
+    # Compressed payloads are counted at their compressed size, their real size is only known once decompressed
+    needed = {}  # {st_dev: [directory, bytes]}, the staged files need all of their space before the old ones go
+    for entry in result.entries:
+        directory = existing_parent(entry.destination)
+        if not os.access(directory, os.W_OK | os.X_OK):
+            problem = f"\"{directory}\" is not writable"
+            if problem not in result.problems:
+                result.problems.append(problem)
+        needed.setdefault(os.stat(directory).st_dev, [directory, 0])[1] += entry.size
+
+    for directory, size in needed.values():
+        stats = os.statvfs(directory)
+        result.free_space[directory] = stats.f_bavail * stats.f_frsize
+        if result.free_space[directory] < size:
+            result.problems.append(f"not enough space for \"{directory}\": {size / 1e6:.1f} MB needed, "
+                                   f"{result.free_space[directory] / 1e6:.1f} MB free")
+
+    for path in (DESKTOP_SHORTCUT_PATH, MENU_SHORTCUT_PATH):
+        result.shortcuts[path] = shortcut_state(path)
+    log_out(f"[preflight]: \"{result.prefix}\": {len(result.problems)} problems, installed version "
+            f"{result.installed_version}, shortcuts {result.shortcuts}")
+    return result
+
+
+class PreflightScan:  # Runs preflight() for both targets on background threads, result() waits for one of them
+    def __init__(self):
+        self.results = {}
+        self.installs = {}  # {prefix: installed version or None} for every prefix the program was found in
+        self.threads = {for_everyone: threading.Thread(target=self.run, args=(for_everyone,), daemon=True,
+                                                       name=f"preflight-{install_prefix(for_everyone)}")
+                        for for_everyone in (False, True)}
+        # Prefixes that are not an install target, like the sudo user's own ~/.local, are only searched for an install
+        targets = [install_prefix(for_everyone) for for_everyone in self.threads]
+        self.detect_threads = [threading.Thread(target=self.detect, args=(prefix,), daemon=True,
+                                                name=f"detect-{prefix}")
+                               for prefix in detection_prefixes() if prefix not in targets]
+
+    def start(self):
+        for thread in list(self.threads.values()) + self.detect_threads:
+            thread.start()
+        return self
+
+    def run(self, for_everyone):
+        try:
+            result = preflight(for_everyone)
+        except OSError as e:  # The install goes ahead unchecked, it still reports its own errors
+            log_out(f"[PreflightScan]: could not check \"{install_prefix(for_everyone)}\": {e}", level=WARNING)
+            return
+        self.results[for_everyone] = result
+        if result.installed:
+            self.installs[result.prefix] = result.installed_version
+
+    def detect(self, prefix):
+        try:
+            installed, version = find_install(prefix)
+        except OSError as e:
+            log_out(f"[PreflightScan]: could not look for an install in \"{prefix}\": {e}", level=WARNING)
+            return
+        if installed:
+            self.installs[prefix] = version
+
+    def finished(self):
+        return not any(thread.is_alive() for thread in list(self.threads.values()) + self.detect_threads)
+
+    def existing_installs(self):  # Once finished(), {prefix: installed version or None} sorted by prefix
+        log_out(f"[PreflightScan]: existing installs {self.installs}")
+        return dict(sorted(self.installs.items()))
+
+    def result(self, for_everyone):  # None when the check itself failed
+        self.threads[for_everyone].join()
+        return self.results.get(for_everyone)
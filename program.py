@@ -0,0 +1,78 @@
+# Everything about the program being installed that both the Qt wizard and the headless installer need
+# Nothing in here imports Qt, and the decompression and install engines are only imported once the payload is read,
+# main.py imports this for its argument defaults before the wizard shows its first page
+import datetime
+import os
+
+from copy_engine import read_payload_digest, DEFAULT_BUFFER_SIZE
+
+
+# Function for retrieving the relative path for resource files
+def get_path(relative_path):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), relative_path)
+
+
+# <CONSTANTS>
+
+PROGRAM_NAME = "IP-Geo"
+BINARY_NAME = "ip-geo"
+VERSION = "1.42"
+LOG_FILENAME = f"{PROGRAM_NAME}_{datetime.datetime.now()}.log"
+LOG_PATH = f"/tmp/{LOG_FILENAME}"
+COPY_BUFFER_SIZE = DEFAULT_BUFFER_SIZE  # Read/write buffer used when copying the binary, clamped to 1-8 MiB
+DURABILITY = "fsync"  # "none", "fsync" or "fsync+dir", see copy_engine.py, --durability overrides it
+DESKTOP_SHORTCUT_PATH = os.path.expanduser(f"~/Desktop/{PROGRAM_NAME}.desktop")
+MENU_SHORTCUT_PATH = os.path.expanduser(f"~/.local/share/applications/{PROGRAM_NAME}.desktop")
+DESKTOP_SHORTCUT_CONTENTS = f"""\
+#!/usr/bin/env xdg-open
+[Desktop Entry]
+Name={PROGRAM_NAME} {VERSION}
+Comment=Locate IP addresses and find information about them
+Exec=bash -c "ip-geo; sleep 10"
+Type=Application
+Categories=Utility;
+Icon=gnome-globe
+Terminal=true\
+"""
+# Placeholders that never change between launches, ui_cache.py fills these in when it compiles the .ui files so
+# only runtime values like {user} are left for the wizard to substitute
+STATIC_SUBSTITUTIONS = {"name": PROGRAM_NAME,
+                        "version": VERSION,
+                        "developer": "Derek Michael Baier",
+                        "maintainer": "Derek Michael Baier",
+                        "email": "Derek.m.baier@gmail.com"}
+
+
+def install_prefix(for_everyone):
+    return "/usr" if for_everyone else os.path.expanduser("~/.local")
+
+
+def payload_entries(prefix):  # Everything listed in manifest.json, or just the binary if there is no manifest
+    from compression import find_payload
+    from install_engine import install_variables, load_manifest, ManifestEntry, MANIFEST_NAME
+
+    variables = install_variables(prefix)
+    if os.path.exists(get_path(MANIFEST_NAME)):
+        return load_manifest(get_path(MANIFEST_NAME), variables)
+    algorithm, digest = read_payload_digest(get_path("binary"))  # Verified while copying when a digest ships with it
+    return [ManifestEntry(find_payload(get_path("binary")), os.path.join(variables["bin"], BINARY_NAME), 0o744,
+                          algorithm, digest)]
+
+
+def write_shortcut(path, contents=DESKTOP_SHORTCUT_CONTENTS):
+    os.makedirs(os.path.dirname(path), exist_ok=True)  # Neither ~/Desktop nor the menu directory always exists
+    with open(path, "w") as f:
+        f.write(contents)
+    os.chmod(path, 0o744)
+
+
+def create_desktop_shortcut():
+    write_shortcut(DESKTOP_SHORTCUT_PATH)
+
+
+def create_menu_shortcut():
+    write_shortcut(MENU_SHORTCUT_PATH)
+
+
+def run_program():
+    os.system(f"x-terminal-emulator -e \"{BINARY_NAME}; sleep 10\"")
@@ -0,0 +1,101 @@
+# Install receipts: a small JSON file per prefix recording the version that was installed there and the size and mtime
+# of every file the install put in place, with its digest when the install hashed it anyway. Detecting an existing
+# install only stats the files against the receipt, a file is hashed only when its metadata no longer matches and
+# the receipt has a digest to compare with, so startup never reads a multi-GB binary
+import json
+import os
+import pwd
+
+from copy_engine import file_digest
+from log import log_out, WARNING
+from program import install_prefix, BINARY_NAME, PROGRAM_NAME, VERSION
+
+
+def receipt_path(prefix):
+    return os.path.join(prefix, "share", "qt-installer", "receipts", f"{PROGRAM_NAME}.json")
+
+
+def real_user_home():  # The home of the user who started the installer, also when it runs through sudo
+    sudo_user = os.environ.get("SUDO_USER")
+    if sudo_user:
+        try:
+            return pwd.getpwnam(sudo_user).pw_dir
+        except KeyError:
+            pass
+    return os.path.expanduser("~")
+
+
+def detection_prefixes():  # Where an earlier install may be, whichever target it was installed for
+    return [install_prefix(True), os.path.join(real_user_home(), ".local")]
+
+
+def installed_digest(entry):  # Returns (algorithm, hex digest) of the file the entry installed, or (None, None)
+    if entry.installed_digest is not None:  # Hashed while it was written
+        return entry.installed_digest
+    if entry.digest is not None:  # Verified while it was written
+        return entry.algorithm, entry.digest
+    return None, None  # Copied by the kernel, hashing it now would cost as much as the copy did
+
+
+def write_receipt(prefix, entries):  # Called once the files are in place, a missing receipt only costs a hash later
+    path = receipt_path(prefix)
+    try:
+        files = []
+        for entry in entries:
+            stat = os.stat(entry.destination)
+            algorithm, digest = installed_digest(entry)
+            files.append({"path": entry.destination, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                          "algorithm": algorithm, "digest": digest})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"name": PROGRAM_NAME, "version": VERSION, "files": files}, f, indent=1)
+        os.replace(path + ".tmp", path)
+    except (OSError, ValueError) as e:
+        log_out(f"[write_receipt]: could not write \"{path}\": {e}", level=WARNING)
+        return False
+    log_out(f"[write_receipt]: recorded {PROGRAM_NAME} {VERSION} in \"{path}\"")
+    return True
+
+
+def load_receipt(prefix):
+    try:
+        with open(receipt_path(prefix)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log_out(f"[load_receipt]: ignoring the unreadable receipt in \"{prefix}\": {e}", level=WARNING)
+        return None
+
+
+def file_unchanged(file):
+    try:
+        stat = os.stat(file["path"])
+    except FileNotFoundError:
+        return False
+    if stat.st_size != file["size"]:
+        return False
+    if stat.st_mtime_ns == file["mtime_ns"]:
+        return True
+    if file["digest"] is None:  # Nothing to compare with, the installed version is unknown
+        log_out(f"[file_unchanged]: \"{file['path']}\" was modified since it was installed")
+        return False
+    log_out(f"[file_unchanged]: \"{file['path']}\" was modified since it was installed, hashing it")
+    return file_digest(file["path"], file["algorithm"]) == file["digest"]
+
+
+def installed_version(prefix):  # The version the receipt records if its files are still as installed, else None
+    receipt = load_receipt(prefix)
+    if receipt is None:
+        return None
+    try:
+        if all(file_unchanged(file) for file in receipt["files"]):
+            return receipt["version"]
+    except (OSError, ValueError, KeyError) as e:
+        log_out(f"[installed_version]: could not check the receipt in \"{prefix}\": {e}", level=WARNING)
+    return None
+
+
+def find_install(prefix):  # (installed, version), version is None when the binary is there without a matching receipt
+    version = installed_version(prefix)
+    return version is not None or os.path.exists(os.path.join(prefix, "bin", BINARY_NAME)), version
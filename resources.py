@@ -0,0 +1,178 @@
+#! /bin/python3
+# Serves the icons from a compiled binary resource file (.rcc) that Qt memory-maps when it is registered, instead of
+# importing Resources_rc.py, which keeps every icon in a bytes literal and registers all of them at import
+# Run this file as a build step to check Resources.qrc for missing files and compile the .rcc next to it:
+#   python3 resources.py
+# register_resources() builds the .rcc on first launch when the build step was skipped or an icon changed
+import hashlib
+import importlib
+import os
+import struct
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+from colors import Colors
+from log import log_out, ERROR
+from program import get_path
+
+fg, bg = Colors.Foreground, Colors.Background
+
+RESOURCE_COLLECTION = "Resources.qrc"
+RESOURCE_CACHE_DIR = os.path.expanduser("~/.cache/qt-installer/resources")  # Used when the install dir is read only
+RCC_FORMAT_VERSION = 2  # Tree nodes carry a last modified time, understood by Qt 5.8 and later
+COMPRESS_THRESHOLD = 70  # percent, like rcc only store a file compressed when that saves at least this much
+DIRECTORY_FLAG, COMPRESSED_FLAG = 0x2, 0x1
+C_LANGUAGE = 1  # QLocale::C, the resources are not localized
+
+
+class MissingResourceError(FileNotFoundError):
+    pass
+
+
+def resource_files(qrc_path):  # {resource path: file on disk} for every <file> in the collection
+    directory = os.path.dirname(os.path.realpath(qrc_path))
+    files = {}
+    for resource in ElementTree.parse(qrc_path).getroot().iter("qresource"):
+        prefix = resource.get("prefix", "/").strip("/")
+        for file in resource.iter("file"):
+            alias = file.get("alias", file.text).strip("/")
+            files["/".join(part for part in (prefix, alias) if part)] = os.path.join(directory, file.text)
+    return files
+
+
+def missing_resources(qrc_path):
+    return [path for path in resource_files(qrc_path).values() if not os.path.exists(path)]
+
+
+def resources_hash(qrc_path):  # Covers the collection and every file in it, so changing an icon rebuilds the .rcc
+    hasher = hashlib.sha256()
+    with open(qrc_path, "rb") as f:
+        hasher.update(f.read())
+    for resource_path, path in sorted(resource_files(qrc_path).items()):
+        hasher.update(resource_path.encode())
+        with open(path, "rb") as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def compiled_paths(qrc_path):  # Next to the collection first, then the per-user cache
+    name = f"{os.path.splitext(os.path.basename(qrc_path))[0]}-{resources_hash(qrc_path)[:16]}.rcc"
+    return [os.path.join(os.path.dirname(os.path.realpath(qrc_path)), name), os.path.join(RESOURCE_CACHE_DIR, name)]
+
+
+def resource_mtime_ms(path):  # The last modified time the .rcc records for a file, QResource.lastModified() reads it
+    return int(os.stat(path).st_mtime * 1000)
+
+
+def qt_hash(name):  # The hash Qt sorts and looks up resource names by
+    value = 0
+    for unit in struct.unpack(f">{len(name)}H", name.encode("utf-16-be")):
+        value = (value << 4) + unit
+        value ^= (value & 0xf0000000) >> 23
+        value &= 0x0fffffff
+    return value
+
+
+def build_tree(files):  # Nested dicts of names, a file is a leaf holding its path on disk
+    root = {}
+    for resource_path, path in files.items():
+        *directories, name = resource_path.split("/")
+        node = root
+        for directory in directories:
+            node = node.setdefault(directory, {})
+        node[name] = path
+    return root
+
+
+def compile_resources(qrc_path, rcc_path):
+    # Writes the same binary layout as "rcc -binary": a header, then the file data, the names and the tree
+    missing = missing_resources(qrc_path)
+    if missing:
+        raise MissingResourceError(f"\"{qrc_path}\" lists files that do not exist: {', '.join(missing)}")
+
+    data, names, tree = bytearray(), bytearray(), bytearray()
+    name_offsets = {}
+
+    def name_offset(name):
+        if name not in name_offsets:
+            name_offsets[name] = len(names)
+            names.extend(struct.pack(">HI", len(name), qt_hash(name)) + name.encode("utf-16-be"))
+        return name_offsets[name]
+
+    nodes = [("", build_tree(resource_files(qrc_path)))]  # Breadth first, the children of a node are contiguous
+    index = 0
+    while index < len(nodes):
+        name, node = nodes[index]
+        offset = name_offset(name) if index else 0  # The root has no name
+        if isinstance(node, dict):
+            children = sorted(node.items(), key=lambda child: qt_hash(child[0]))
+            tree.extend(struct.pack(">IHIIQ", offset, DIRECTORY_FLAG, len(children), len(nodes), 0))
+            nodes.extend(children)
+        else:
+            with open(node, "rb") as f:
+                content = f.read()
+            flags = 0
+            compressed = struct.pack(">I", len(content)) + zlib.compress(content, 9)  # qUncompress's format
+            if content and (len(content) - len(compressed)) * 100 >= len(content) * COMPRESS_THRESHOLD:
+                content, flags = compressed, COMPRESSED_FLAG
+            tree.extend(struct.pack(">IHHHIQ", offset, flags, 0, C_LANGUAGE, len(data), resource_mtime_ms(node)))
+            data.extend(struct.pack(">I", len(content)) + content)
+        index += 1
+
+    header_size = 20
+    header = b"qres" + struct.pack(">IIII", RCC_FORMAT_VERSION, header_size + len(data) + len(names), header_size,
+                                   header_size + len(data))
+    os.makedirs(os.path.dirname(rcc_path), exist_ok=True)
+    with open(rcc_path + ".tmp", "wb") as f:
+        f.write(header + data + names + tree)
+    os.replace(rcc_path + ".tmp", rcc_path)  # Qt maps the file, it must never see a half written one
+    log_out(f"[compile_resources]: compiled \"{qrc_path}\" to \"{rcc_path}\"")
+
+
+def find_compiled_resources(qrc_path):  # Returns an up to date .rcc, compiling one if needed, or None
+    missing = missing_resources(qrc_path)
+    if missing:  # Checked before hashing the files
+        raise MissingResourceError(f"\"{qrc_path}\" lists files that do not exist: {', '.join(missing)}")
+    candidates = compiled_paths(qrc_path)
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    for candidate in candidates:
+        try:
+            compile_resources(qrc_path, candidate)
+        except OSError as e:
+            log_out(f"[find_compiled_resources]: could not write \"{candidate}\": {e}")
+            continue
+        return candidate
+    return None
+
+
+def register_resources(qrc_path=get_path(RESOURCE_COLLECTION)):
+    # Only registers the .rcc, Qt reads an icon out of the mapped file when a page first shows it
+    from PyQt5.QtCore import QResource
+
+    try:
+        rcc_path = find_compiled_resources(qrc_path)
+    except MissingResourceError as e:
+        log_out(fg.red + f"[register_resources]: {e}" + Colors.reset, level=ERROR)
+        rcc_path = None
+    if rcc_path is not None and QResource.registerResource(rcc_path):
+        return True
+    log_out("[register_resources]: no usable .rcc, falling back to the generated Resources_rc module")
+    importlib.import_module("Resources_rc")  # Registers every icon at import
+    return False
+
+
+def main():
+    qrc_path = get_path(RESOURCE_COLLECTION)
+    missing = missing_resources(qrc_path)
+    if missing:
+        for path in missing:
+            print(fg.red + f"Missing resource: {path}" + Colors.reset)
+        return 1
+    compile_resources(qrc_path, compiled_paths(qrc_path)[0])
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
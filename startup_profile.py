@@ -0,0 +1,28 @@
+# Per-phase startup timings for --profile-startup, import this before anything else so the imports are measured too
+import json
+import time
+
+from log import log_out
+
+STARTUP_TIME = time.perf_counter()
+phases = []  # (phase, seconds since the previous mark)
+last_mark = STARTUP_TIME
+
+
+def mark(phase):  # Close the current phase, everything since the previous mark is charged to it
+    global last_mark
+    now = time.perf_counter()
+    phases.append((phase, now - last_mark))
+    last_mark = now
+
+
+def report(path=None):
+    total = last_mark - STARTUP_TIME
+    log_out("[startup_profile]: startup time per phase:")
+    for phase, seconds in phases:
+        log_out(f"[startup_profile]:   {phase:<16} {seconds * 1000:8.1f} ms")
+    log_out(f"[startup_profile]:   {'total':<16} {total * 1000:8.1f} ms")
+    if path:
+        with open(path, "w") as f:
+            json.dump({"phases": {phase: seconds for phase, seconds in phases}, "total": total}, f, indent=4)
+        log_out(f"[startup_profile]: wrote timings to \"{path}\"")
@@ -0,0 +1,64 @@
+# Caches the generated qdarkstyle stylesheet on disk, keyed by the qdarkstyle version, so it is only built once
+# The first line of a cached stylesheet lists the qdarkstyle resource modules it needs, a cache hit imports those
+# so the icons the stylesheet refers to (":/qss_icons/...") are still registered
+import importlib
+import importlib.metadata
+import os
+import sys
+
+from log import log_out
+
+STYLE_CACHE_DIR = os.path.expanduser("~/.cache/qt-installer/style")
+RESOURCE_HEADER = "/* resources: "
+
+
+def qdarkstyle_version():
+    try:
+        return importlib.metadata.version("QDarkStyle")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def read_cached_stylesheet(cache_path):
+    try:
+        with open(cache_path) as f:
+            stylesheet = f.read()
+    except OSError:
+        return None
+    header = stylesheet.split("\n", 1)[0]
+    if not header.startswith(RESOURCE_HEADER):
+        return None
+    for module in header[len(RESOURCE_HEADER):].rstrip(" */").split():
+        importlib.import_module(module)
+    return stylesheet
+
+
+def write_cached_stylesheet(cache_path, stylesheet, resource_modules):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", "w") as f:
+            f.write(f"{RESOURCE_HEADER}{' '.join(resource_modules)} */\n{stylesheet}")
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as e:
+        log_out(f"[write_cached_stylesheet]: could not cache the stylesheet: {e}")
+
+
+def load_dark_stylesheet():  # Returns an empty stylesheet (the default Qt style) when qdarkstyle is missing
+    version = qdarkstyle_version()
+    if version is None:
+        print("Recoverable exception: could not find module \"qdarkstyle\"")
+        return ""
+
+    cache_path = os.path.join(STYLE_CACHE_DIR, f"qdarkstyle-{version}.qss")
+    stylesheet = read_cached_stylesheet(cache_path)
+    if stylesheet is not None:
+        return stylesheet
+
+    modules_before = set(sys.modules)
+    import qdarkstyle
+    stylesheet = qdarkstyle.load_stylesheet_pyqt5()
+    resource_modules = sorted(module for module in set(sys.modules) - modules_before
+                              if module.startswith("qdarkstyle") and module.endswith("_rc"))
+    write_cached_stylesheet(cache_path, stylesheet, resource_modules)
+    log_out(f"[load_dark_stylesheet]: cached the qdarkstyle {version} stylesheet in \"{cache_path}\"")
+    return stylesheet
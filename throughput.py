@@ -0,0 +1,47 @@
+# Throughput and time left for the progress displays, smoothed with an exponentially weighted moving average so a
+# single slow or fast chunk does not make the estimate jump around
+import time
+
+EWMA_WEIGHT = 0.3  # Weight of the newest sample
+MIN_SAMPLE_INTERVAL = 0.25  # seconds, updates closer together than this are merged into the next sample
+
+
+def format_duration(seconds):
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    return f"{seconds // 60}:{seconds % 60:02}"
+
+
+class Throughput:
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.rate = None  # bytes per second
+        self.last_time = time.monotonic()
+        self.last_bytes = 0
+
+    def update(self, done_bytes, now=None):
+        self.done_bytes = done_bytes
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_time
+        if elapsed < MIN_SAMPLE_INTERVAL:
+            return
+        rate = (done_bytes - self.last_bytes) / elapsed
+        self.rate = rate if self.rate is None else EWMA_WEIGHT * rate + (1 - EWMA_WEIGHT) * self.rate
+        self.last_time, self.last_bytes = now, done_bytes
+
+    def update_percent(self, percent, now=None):  # For progress that is only reported as a percentage
+        self.update(self.total_bytes * percent // 100, now)
+
+    def seconds_left(self):
+        if not self.rate:
+            return None
+        return max(0, self.total_bytes - self.done_bytes) / self.rate
+
+    def describe(self):  # "12.3 MB/s, 1:05 left", empty until there is a first estimate
+        if self.rate is None:
+            return ""
+        seconds_left = self.seconds_left()
+        left = f", {format_duration(seconds_left)} left" if seconds_left is not None else ""
+        return f"{self.rate / 1e6:.1f} MB/s{left}"
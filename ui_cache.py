@@ -0,0 +1,164 @@
+#! /bin/python3
+# Compiles the QtDesigner .ui files into Python modules so startup does not have to parse the XML and exec the
+# generated code every launch, run this file as a build step to precompile every .ui file next to it:
+#   python3 ui_cache.py
+# load_ui() checks the compiled module against a hash of its .ui file and recompiles it when it is stale
+# The static placeholders ({name}, {version}, ...) are baked into the compiled module, the widgets that still hold
+# runtime placeholders are listed in the form class's placeholder_widgets so the wizard only has to visit those
+# Page images are left out of setupUi() and listed in deferred_pixmaps, the wizard loads them when a page is first
+# shown, the compiled module does not import Resources_rc either, resources.py registers the icons instead
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+from log import log_out
+from placeholders import compile_template, has_placeholders, render
+from program import STATIC_SUBSTITUTIONS
+
+UI_FILES = ("main.ui", "Upgrade.ui")
+UI_CACHE_VERSION = 2  # Part of the hash, bump it when what compile_ui() generates changes
+UI_CACHE_DIR = os.path.expanduser("~/.cache/qt-installer/ui")  # Used when the install directory is read only
+
+
+def ui_hash(ui_path, substitutions=STATIC_SUBSTITUTIONS):  # A new version number has to recompile the UI as well
+    with open(ui_path, "rb") as f:
+        hasher = hashlib.sha256(f.read())
+    hasher.update(json.dumps([UI_CACHE_VERSION, substitutions], sort_keys=True).encode())
+    return hasher.hexdigest()
+
+
+def compiled_paths(ui_path):  # Next to the .ui file first, then the per-user cache
+    module_name = os.path.splitext(os.path.basename(ui_path))[0] + "_ui.py"
+    return [os.path.join(os.path.dirname(os.path.realpath(ui_path)), module_name),
+            os.path.join(UI_CACHE_DIR, module_name)]
+
+
+def read_header(module_path):  # The first lines of a compiled module record what it was built from
+    header = {}
+    try:
+        with open(module_path) as f:
+            for line in f:
+                if not line.startswith("UI_"):
+                    break
+                key, value = line.split(" = ", 1)
+                header[key] = value.strip().strip('"')
+    except OSError:
+        pass
+    return header
+
+
+def bake_placeholders(tree, substitutions):
+    # Fills in the given placeholders in every string of the .ui XML, returns the names of the widgets whose texts
+    # still contain placeholders afterwards
+    root = tree.getroot()
+    parents = {child: parent for parent in root.iter() for child in parent}
+    dynamic_widgets = []
+    for string in root.iter("string"):
+        if not string.text or not has_placeholders(compile_template(string.text)):
+            continue
+        string.text = render(compile_template(string.text), substitutions)
+        if not has_placeholders(compile_template(string.text)):
+            continue
+        owner = parents[string]
+        tab_title = owner.tag == "attribute" and owner.get("name") == "title"
+        while owner.tag != "widget":
+            owner = parents[owner]
+        if tab_title:  # A page's title is shown, and substituted, by the QTabWidget it is on
+            owner = parents[owner]
+        if owner.get("name") not in dynamic_widgets:
+            dynamic_widgets.append(owner.get("name"))
+    return dynamic_widgets
+
+
+def defer_pixmaps(tree):  # Removes resource pixmaps from the .ui XML, returns {widget name: resource path}
+    root = tree.getroot()
+    deferred = {}
+    for widget in root.iter("widget"):
+        for pixmap_property in widget.findall("property"):
+            pixmap = pixmap_property.find("pixmap")
+            if pixmap_property.get("name") == "pixmap" and pixmap is not None and pixmap.text.startswith(":/"):
+                deferred[widget.get("name")] = pixmap.text
+                widget.remove(pixmap_property)
+    resources = root.find("resources")
+    if resources is not None:  # Otherwise uic adds "import Resources_rc" to the compiled module
+        root.remove(resources)
+    return deferred
+
+
+def compile_ui(ui_path, module_path, substitutions=STATIC_SUBSTITUTIONS):
+    from PyQt5 import uic  # Only needed when the cache is missing or stale
+
+    tree = ElementTree.parse(ui_path)
+    root = tree.getroot()
+    form_class = "Ui_" + root.find("class").text
+    base_class = root.find("widget").get("class")
+    dynamic_widgets = bake_placeholders(tree, substitutions)
+    deferred_pixmaps = defer_pixmaps(tree)
+    baked_ui = io.BytesIO()
+    tree.write(baked_ui, encoding="utf-8")
+    baked_ui.seek(0)
+    baked_ui.name = ui_path  # uic names the source in the generated module's header
+
+    os.makedirs(os.path.dirname(module_path), exist_ok=True)
+    temporary_path = module_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        f.write(f"UI_HASH = \"{ui_hash(ui_path, substitutions)}\"\n"
+                f"UI_FORM_CLASS = \"{form_class}\"\n"
+                f"UI_BASE_CLASS = \"{base_class}\"\n")
+        uic.compileUi(baked_ui, f)
+        f.write(f"\n\n{form_class}.placeholder_widgets = {tuple(dynamic_widgets)!r}\n"
+                f"{form_class}.deferred_pixmaps = {deferred_pixmaps!r}\n")
+    os.replace(temporary_path, module_path)  # Never leave a half written module for the next launch to import
+    log_out(f"[compile_ui]: compiled \"{ui_path}\" to \"{module_path}\"")
+
+
+def import_module(module_path):
+    name = os.path.splitext(os.path.basename(module_path))[0]
+    spec = importlib.util.spec_from_file_location(name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_ui(ui_path, substitutions=STATIC_SUBSTITUTIONS):
+    # Drop in replacement for uic.loadUiType, returns (form class, base class)
+    from PyQt5 import QtWidgets
+
+    current_hash = ui_hash(ui_path, substitutions)
+    module_path = None
+    for candidate in compiled_paths(ui_path):
+        if read_header(candidate).get("UI_HASH") == current_hash:
+            module_path = candidate
+            break
+
+    if module_path is None:  # Missing or stale, recompile into the first location we can write to
+        for candidate in compiled_paths(ui_path):
+            try:
+                compile_ui(ui_path, candidate, substitutions)
+            except OSError as e:
+                log_out(f"[load_ui]: could not write \"{candidate}\": {e}")
+                continue
+            module_path = candidate
+            break
+        else:
+            from PyQt5 import uic
+            log_out(f"[load_ui]: no writable cache location, loading \"{ui_path}\" directly")
+            return uic.loadUiType(ui_path)
+
+    module = import_module(module_path)
+    return getattr(module, module.UI_FORM_CLASS), getattr(QtWidgets, module.UI_BASE_CLASS)
+
+
+def main():
+    directory = os.path.dirname(os.path.realpath(__file__))
+    for ui_file in UI_FILES:
+        ui_path = os.path.join(directory, ui_file)
+        compile_ui(ui_path, compiled_paths(ui_path)[0])
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
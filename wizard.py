@@ -0,0 +1,465 @@
+# The Qt install wizard, main.py only imports this module when the installer is not running headless
+import asyncio
+import getpass
+import html
+import os
+import sys
+import threading
+import time
+from functools import partial
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import (QApplication, QMessageBox, QWidget, QLabel, QAbstractButton, QGroupBox, QTabWidget,
+                             QTextEdit)
+
+# Get some colored terminal output
+from colors import Colors
+from icon_cache import load_icon
+from log import log_out, open_log, close_log, WARNING, ERROR
+from placeholders import compile_template, has_placeholders, render
+from preflight import PreflightScan
+from receipts import write_receipt
+from resources import register_resources
+from program import (get_path, install_prefix, payload_entries, create_desktop_shortcut, create_menu_shortcut,
+                     run_program, PROGRAM_NAME, LOG_PATH, COPY_BUFFER_SIZE, DURABILITY, STATIC_SUBSTITUTIONS,
+                     DESKTOP_SHORTCUT_PATH, MENU_SHORTCUT_PATH)
+import startup_profile
+from style_cache import load_dark_stylesheet
+from throughput import Throughput
+from ui_cache import load_ui
+
+try:
+    import qasync
+except ModuleNotFoundError:  # Optional, without it the install runs on a CopyWorker thread instead of the Qt event loop
+    qasync = None
+
+fg, bg = Colors.Foreground, Colors.Background
+startup_profile.mark("imports")
+
+
+# Set text substitutions here, to use them place the key of a dictionary itme in curly brackets: {}
+# For example, in the ui file created in QtDesigner you can place {home} and make an entry below to 
+# replace it with the users home path at runtime, the mentioned code would look like this
+"""
+SUBSTITUTIONS = dict(STATIC_SUBSTITUTIONS, home=os.path.expanduser("~"))
+
+"""
+# Make sure to call parse_placeholders() on the window or page before it is shown!
+# Values that are the same on every machine belong in STATIC_SUBSTITUTIONS (program.py), those are baked into the
+# compiled UI by ui_cache.py and cost nothing at runtime
+
+# <CONSTANTS>
+
+INSTALLED = False
+copy_worker = None
+install_task = None  # The install_pipeline() task when qasync drives the event loop
+preflight_scan = None  # Started at launch, checks both install targets while the first pages are shown
+preflight_timer = None  # Polls preflight_scan from launch until it is finished
+install_percent = 0  # Written by the install workers, read by refresh_progress() in the GUI thread
+progress_timer = None
+install_throughput = None
+PROGRESS_FRAME_RATE = 30  # Hz, the install page redraws the progress at most this often
+install_durability = DURABILITY  # Set from --durability
+NOQDARKSTYLE = "NOQDARKSTYLE" in os.environ  # Set NOQDARKSTYLE to use the default Qt style instead of QDarkStyle
+
+SUBSTITUTIONS = dict(STATIC_SUBSTITUTIONS, user=getpass.getuser().title())
+
+PAGES = {0: "welcome",
+         1: "license",
+         2: "install",
+         3: "done"}
+
+# The images and placeholders of a page are only loaded once it is first shown
+prepared_pages = set()
+widget_templates = {}  # (widget, text slot) -> (compiled template of the text as it was in the .ui file, is rich text)
+
+
+def text_slots(widget):  # (slot, getter, setter) for every text of a widget that can hold placeholders
+    if isinstance(widget, QTextEdit):  # Rich text goes through HTML so the formatting of the .ui file is kept
+        yield "html", widget.toHtml, widget.setHtml
+    elif isinstance(widget, (QLabel, QAbstractButton)):  # Rich text labels return and take their HTML here
+        yield "text", widget.text, widget.setText
+    elif isinstance(widget, QGroupBox):
+        yield "title", widget.title, widget.setTitle
+    elif isinstance(widget, QTabWidget):
+        for index in range(widget.count()):
+            yield f"tab {index}", partial(widget.tabText, index), partial(widget.setTabText, index)
+    if widget.isWindow():
+        yield "window title", widget.windowTitle, widget.setWindowTitle
+
+
+def is_rich_text(widget, slot, text):  # Values substituted into rich text are HTML escaped
+    if slot == "html":
+        return True
+    if slot != "text" or not isinstance(widget, QLabel):
+        return False
+    if widget.textFormat() == QtCore.Qt.AutoText:  # Decided on the .ui text, a value like "Name <addr>" cannot flip it
+        widget.setTextFormat(QtCore.Qt.RichText if QtCore.Qt.mightBeRichText(text) else QtCore.Qt.PlainText)
+    return widget.textFormat() == QtCore.Qt.RichText
+
+
+def parse_placeholders(widgets) -> None:
+    # Every text is compiled into a template the first time it is seen, calling this again after SUBSTITUTIONS
+    # changed renders the cached templates instead of the already substituted texts
+    escaped = {key: html.escape(value) for key, value in SUBSTITUTIONS.items()}
+    for widget in widgets:
+        for slot, get_text, set_text in text_slots(widget):
+            cached = widget_templates.get((widget, slot))
+            if cached is None:
+                text = get_text()
+                template = compile_template(text)
+                cached = widget_templates[widget, slot] = (template, has_placeholders(template)
+                                                           and is_rich_text(widget, slot, text))
+            template, rich = cached
+            if has_placeholders(template):
+                set_text(render(template, escaped if rich else SUBSTITUTIONS))
+
+
+def widget_tree(root):
+    return [root] + root.findChildren(QWidget)
+
+
+def prepare_window() -> None:  # Window title, tab labels and buttons, everything outside of the pages
+    dynamic_widgets = getattr(Form, "placeholder_widgets", None)
+    if dynamic_widgets is not None:  # ui_cache.py baked the static placeholders in and indexed the rest
+        parse_placeholders([window if name == window.objectName() else getattr(form, name)
+                            for name in dynamic_widgets])
+        return
+    parse_placeholders([widget for widget in widget_tree(window)
+                        if widget is form.tabs or not form.tabs.isAncestorOf(widget)])
+
+
+def prepare_page(index) -> None:  # Load the images and fill in the placeholders of a page the first time it is shown
+    if index in prepared_pages:
+        return
+    prepared_pages.add(index)
+    load_page_images(index)
+    if getattr(Form, "placeholder_widgets", None) is None:  # Not baked in by ui_cache.py
+        parse_placeholders(widget_tree(form.tabs.widget(index)))
+
+
+def load_page_images(index) -> None:  # Prerendered for the screen's device pixel ratio by icon_cache.py
+    page = form.tabs.widget(index)
+    for name, resource_path in getattr(Form, "deferred_pixmaps", {}).items():
+        widget = getattr(form, name)
+        if page.isAncestorOf(widget):
+            widget.setPixmap(load_icon(resource_path, widget.devicePixelRatioF()))
+
+
+def screen_changed(screen) -> None:  # Swap in the images for the new screen's device pixel ratio
+    log_out(f"[screen_changed]: moved to \"{screen.name()}\" at {screen.devicePixelRatio()}x")
+    for index in prepared_pages:
+        load_page_images(index)
+
+
+class FirstPaintWatcher(QtCore.QObject):  # Closes the "first paint" phase of --profile-startup
+    def __init__(self, profile_path):
+        super().__init__()
+        self.profile_path = profile_path
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            startup_profile.mark("first paint")
+            startup_profile.report(self.profile_path)
+        return False
+
+
+class CopyWorker(QtCore.QThread):  # Runs the install off the GUI thread so the window keeps repainting during the copy
+    completed = QtCore.pyqtSignal(bool)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, entries, prefix, buffer_size=COPY_BUFFER_SIZE, durability=DURABILITY):
+        super().__init__()
+        self.entries = entries
+        self.prefix = prefix
+        self.buffer_size = buffer_size
+        self.durability = durability
+        self.cancel_event = threading.Event()  # Set from the GUI thread to stop the copy between chunks
+
+    def run(self) -> None:
+        from install_engine import install_manifest  # Loaded by the pre-flight scan by now, see install()
+
+        try:
+            completed = install_manifest(self.entries, self.prefix, progress_callback=set_install_percent,
+                                         cancel_event=self.cancel_event, buffer_size=self.buffer_size,
+                                         durability=self.durability)
+        except (IOError, ValueError) as e:
+            self.failed.emit(str(e))
+            return
+        if completed:  # Lets the next launch recognise this install without hashing it
+            write_receipt(self.prefix, self.entries)
+        self.completed.emit(completed)
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+
+def next_tab() -> None:  # Manage tab changes using the next button
+    global tabChangeAllowed, currentPage, window
+    if PAGES[currentPage] == "license":
+        if not form.accepted.isChecked():
+            log_out(
+                fg.yellow + "[next_tab]: Please accept the terms and conditions in order to proceed!" + Colors.reset,
+                level=WARNING)
+            QMessageBox.information(window, "License", "Please accept the terms and conditions in order to proceed!"),
+            return
+        print("[next_tab]: Terms and con")
+    if PAGES[currentPage] == "install":
+        log_out("[next_tab]: Install button pressed, installing and disabling next button")
+        form.next_button.setEnabled(False)
+        install()
+        return  # install_finished() moves on to the next tab once the copy worker is done
+    advance_tab()
+
+
+def advance_tab() -> None:
+    global tabChangeAllowed, currentPage
+    if currentPage < form.tabs.count() - 1:
+        currentPage += 1
+        tabChangeAllowed = True
+        form.tabs.setCurrentIndex(currentPage)
+        tabChangeAllowed = False
+    prepare_page(currentPage)
+    if PAGES[currentPage] == "install":
+        log_out("[next_tab]: Changing next button text to \"Install\"")
+        form.next_button.setText("Install")
+        wait_for_preflight()
+
+
+def wait_for_preflight() -> None:  # Keeps Install disabled until the scan reported back, the GUI thread never waits
+    if not preflight_scan.finished():
+        log_out("[wait_for_preflight]: Pre-flight checks still running, disabling the install button")
+        form.next_button.setEnabled(False)
+
+
+def check_preflight() -> None:  # Asks about earlier installs once the scan found them, and re-enables Install
+    if not preflight_scan.finished():
+        return
+    preflight_timer.stop()
+    if not confirm_existing_installs(preflight_scan.existing_installs()):
+        close_window()
+        return
+    if PAGES[currentPage] == "install":
+        form.next_button.setEnabled(True)
+
+
+def install() -> None:  # Copy the payload into the prefix, the GUI thread only redraws the progress meanwhile
+    global copy_worker, install_task, install_percent, progress_timer, install_throughput
+    # The copy stack is left out of the wizard's imports, the pre-flight scan has normally loaded it on its threads
+    from install_pipeline import install_pipeline
+
+    for_everyone = form.installForEveryone.isChecked()
+    prefix = install_prefix(for_everyone)
+    preflight_result = preflight_scan.result(for_everyone)  # Already finished, Install is disabled until it is
+    if preflight_result is not None and preflight_result.problems:
+        preflight_failed(preflight_result.problems)
+        return
+    try:
+        entries = preflight_result.entries if preflight_result is not None else payload_entries(prefix)
+    except (IOError, ValueError, KeyError) as e:
+        install_failed(f"could not read the install manifest: {e}")
+        return
+
+    install_percent = 0
+    install_throughput = Throughput(sum(entry.size for entry in entries))
+    # The workers only store the latest percentage, the page picks it up once per frame however often it changes
+    progress_timer = QtCore.QTimer()
+    progress_timer.setInterval(1000 // PROGRESS_FRAME_RATE)
+    progress_timer.timeout.connect(refresh_progress)
+    progress_timer.start()
+    if qasync is not None:
+        install_task = asyncio.ensure_future(install_pipeline(entries, prefix,
+                                                              progress_callback=set_install_percent,
+                                                              buffer_size=COPY_BUFFER_SIZE,
+                                                              durability=install_durability))
+        install_task.add_done_callback(install_done)
+    else:
+        copy_worker = CopyWorker(entries, prefix, durability=install_durability)
+        copy_worker.completed.connect(install_finished)
+        copy_worker.failed.connect(install_failed)
+        copy_worker.start()
+
+
+def set_install_percent(percent) -> None:
+    global install_percent
+    install_percent = percent
+
+
+def install_done(task) -> None:  # The pipeline's counterpart of the CopyWorker signals
+    if task.cancelled():
+        install_finished(False)
+    elif task.exception() is not None:
+        install_failed(str(task.exception()))
+    else:
+        install_finished(task.result())
+
+
+def refresh_progress() -> None:
+    percent = install_percent
+    install_throughput.update_percent(percent)
+    if form.installProgress.value() != percent:
+        form.installProgress.setValue(percent)
+    text_format = f"%p%  {install_throughput.describe()}".rstrip()
+    if form.installProgress.format() != text_format:
+        form.installProgress.setFormat(text_format)
+
+
+def stop_progress() -> None:  # Draws the last frame and stops the timer
+    if progress_timer is not None and progress_timer.isActive():
+        progress_timer.stop()
+        refresh_progress()
+
+
+def preflight_failed(problems) -> None:
+    message = "\n".join(problems)
+    QMessageBox.critical(window, "Cannot Install",
+                         f"The installer cannot install here, nothing was copied:\n\n{message}")
+    log_out(fg.red + f"[install]: pre-flight check failed: {message}" + Colors.reset, level=ERROR)
+    form.next_button.setEnabled(True)
+
+
+def install_finished(completed) -> None:
+    stop_progress()
+    if completed:
+        preflight_result = preflight_scan.result(form.installForEveryone.isChecked())
+        if preflight_result is not None:  # Shortcuts in a read only directory cannot be added
+            form.addDesktopEntry.setEnabled(preflight_result.shortcuts[DESKTOP_SHORTCUT_PATH] is not None)
+            form.addMenuEntry.setEnabled(preflight_result.shortcuts[MENU_SHORTCUT_PATH] is not None)
+        form.next_button.hide()
+        log_out("[next_tab]: Installed, changing next button text to \"Exit\"")
+        form.cancel.setText("Exit")
+        advance_tab()
+    else:
+        print("[install]: Installation canceled")
+        if window.isVisible():
+            QMessageBox.warning(window, "Installation Canceled", "Installation was canceled by the user!")
+        log_out("Installation canceled: exiting")
+        close_window()
+
+
+def install_failed(error) -> None:
+    stop_progress()
+    QMessageBox.critical(window, "Failed",
+                         f"The installer failed to copy the required files!\n Please retry as root\n\n{error}")
+    log_out(fg.red + f"[install]: {error}" + Colors.reset, level=ERROR)
+    form.next_button.setEnabled(True)
+
+
+def stop_install() -> None:  # Cancel a running copy and wait for the worker so it never outlives the window
+    if install_task is not None and not install_task.done():  # main() waits for the pipeline to finish cleaning up
+        log_out("[stop_install]: Canceling the install pipeline")
+        install_task.cancel()
+    if copy_worker is not None and copy_worker.isRunning():
+        log_out("[stop_install]: Canceling the running copy")
+        copy_worker.cancel()
+        copy_worker.wait()
+
+
+def tab_change() -> None:  # Block manual tab changes
+    global tabChangeAllowed, currentPage
+    if not tabChangeAllowed:
+        log_out("[tab_change]: Blocked manual tab change")
+        tabChangeAllowed = True
+        form.tabs.setCurrentIndex(currentPage)
+        tabChangeAllowed = False
+
+
+def close_window():
+    log_out("[close_window]: Closing")
+    stop_install()
+    print(window.isVisible())
+    window.close()
+    print(window.isVisible())
+
+
+def confirm_existing_installs(installs) -> bool:  # Asks before installing over an earlier install
+    if not installs:
+        return True
+    found = "\n".join(f"{PROGRAM_NAME} {version if version is not None else '(unknown version)'} in {prefix}"
+                      for prefix, version in installs.items())
+    return QMessageBox.warning(window, "Warning", f"The installer found an existing version of this program:\n\n{found}"
+                                                "\n\nWould you like to continue?",
+                               QMessageBox.Ok | QMessageBox.Cancel) == QMessageBox.Ok
+
+
+def initialize_user_interface():
+    global form, window, app, currentPage, tabChangeAllowed
+
+    form = Form()  # Set the window contents
+    form.setupUi(window)  # Set up the UI
+    startup_profile.mark("UI setup")
+
+    currentPage = 0  # Set the starting page
+    tabChangeAllowed = False
+
+    if os.geteuid() == 0:  # User has root access so allow installing for everyone
+        form.installForEveryone.setEnabled(True)
+        form.installForEveryone.setChecked(True)
+    else:  # User lacks root access, disable "install for everyone"
+        form.installForEveryone.setEnabled(False)
+        form.installForMeOnly.setChecked(True)
+
+    prepare_window()
+    prepare_page(currentPage)  # The other pages are prepared when advance_tab first shows them
+    startup_profile.mark("placeholders")
+
+    # Connect UI form signals
+    form.tabs.setCurrentIndex(currentPage)
+    form.cancel.clicked.connect(close_window)
+    form.next_button.clicked.connect(next_tab)
+    form.launchNow.clicked.connect(run_program)
+    form.tabs.currentChanged.connect(tab_change)
+    form.addDesktopEntry.clicked.connect(create_desktop_shortcut)
+    form.addMenuEntry.clicked.connect(create_menu_shortcut)
+
+
+def main(arguments):
+    global app, Form, form, Window, window, currentPage, tabChangeAllowed, install_durability
+    global preflight_scan, preflight_timer
+    install_durability = arguments.durability
+    open_log(LOG_PATH)
+    preflight_scan = PreflightScan().start()  # Runs while Qt starts up and the user reads the first pages
+    app = QApplication([])
+    startup_profile.mark("QApplication")
+    if not NOQDARKSTYLE:
+        app.setStyleSheet(load_dark_stylesheet())  # Applied once for the whole application (using QDarkStyle)
+    startup_profile.mark("stylesheet")
+    register_resources()  # Before setupUi(), the window icon comes from the resources
+    startup_profile.mark("resources")
+    Form, Window = load_ui(get_path("main.ui"))  # Load the precompiled UI, recompiling it if main.ui changed
+    window = Window()
+    form = Form()
+    startup_profile.mark("UI load")
+
+    currentPage = 0
+    tabChangeAllowed = False
+    log_out("Initializing user interface... ", end="")
+    initialize_user_interface()  # Create the UI
+    log_out("Done")
+    if arguments.profile_startup is not None:
+        first_paint_watcher = FirstPaintWatcher(arguments.profile_startup)
+        window.installEventFilter(first_paint_watcher)
+    window.show()  # Show the UI
+    window.windowHandle().screenChanged.connect(screen_changed)
+    # The scan also looks for earlier installs, the user is asked about them once it is done instead of the first
+    # paint waiting for it
+    preflight_timer = QtCore.QTimer()
+    preflight_timer.setInterval(100)
+    preflight_timer.timeout.connect(check_preflight)
+    preflight_timer.start()
+    if qasync is not None:  # asyncio runs on the Qt event loop, so the install pipeline's stages are plain tasks
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+        app_closed = asyncio.Event()
+        app.aboutToQuit.connect(app_closed.set)
+        with loop:
+            loop.run_until_complete(app_closed.wait())
+            stop_install()  # The window may have been closed while the copy was still running
+            if install_task is not None:
+                loop.run_until_complete(asyncio.wait([install_task]))
+    else:
+        app.exec()  # Run the app
+        stop_install()  # The window may have been closed while the copy was still running
+    close_log()
+    return 0